@@ -3,6 +3,7 @@ from tkinter import filedialog, messagebox, ttk, Toplevel
 from scripts import preprocessing
 from scripts import processing
 from scripts import image_loader
+from scripts import output_format
 import rasterio as rio
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
@@ -335,8 +336,9 @@ class TrainModelUI:
             self.pre_preprocess_entry.grid_remove()
             self.pre_preprocess_button.grid_remove()
 
-    def load_pre_folder(self):
-        folder_path = filedialog.askdirectory(title="Select a Folder")
+    def load_pre_folder(self, folder_path=None):
+        if folder_path is None:
+            folder_path = filedialog.askdirectory(title="Select a Folder")
         if not folder_path:
             return
         
@@ -344,7 +346,7 @@ class TrainModelUI:
         self.update_state_label("Generating Stacked Raster for Pre Image...")
         
         try:
-            stacked_image_path = image_loader.load_image(folder_path, satellite)
+            stacked_image_path = image_loader.load_image(folder_path, satellite, operations=image_loader.PRE_IMAGE_OPERATIONS)
             self.update_state_label("Stacked Raster for Pre Image Generated!")
             self.pre_entry.delete(0, tk.END)
             self.pre_entry.insert(0, stacked_image_path)
@@ -360,7 +362,11 @@ class TrainModelUI:
             messagebox.showerror("Error", f"Failed to stack raster for Pre Image: {e}")
 
     def load_pre_image(self):
-        file_path = filedialog.askopenfilename(filetypes=[("Raster Files", "*.tif;*.tiff;*.img;*.jp2")])
+        file_path = filedialog.askopenfilename(filetypes=[("Raster Files", "*.tif;*.tiff;*.img;*.jp2;*.vrt"), ("Product Archives", "*.zip;*.tar;*.tar.gz;*.tgz")])
+        if file_path and image_loader.is_archive(file_path):
+            # Zipped/tarred products are stacked in place, like a product folder
+            self.load_pre_folder(file_path)
+            return
         if file_path:
             self.pre_entry.delete(0, tk.END)
             self.pre_entry.insert(0, file_path)
@@ -436,8 +442,9 @@ class TrainModelUI:
             self.post_preprocess_entry.grid_remove()
             self.post_preprocess_button.grid_remove()
 
-    def load_post_folder(self):
-        folder_path = filedialog.askdirectory(title="Select a Folder")
+    def load_post_folder(self, folder_path=None):
+        if folder_path is None:
+            folder_path = filedialog.askdirectory(title="Select a Folder")
         if not folder_path:
             return
         
@@ -461,7 +468,11 @@ class TrainModelUI:
             messagebox.showerror("Error", f"Failed to stack raster for Post Image: {e}")
 
     def load_post_image(self):
-        file_path = filedialog.askopenfilename(filetypes=[("Raster Files", "*.tif;*.tiff;*.img;*.jp2")])
+        file_path = filedialog.askopenfilename(filetypes=[("Raster Files", "*.tif;*.tiff;*.img;*.jp2;*.vrt"), ("Product Archives", "*.zip;*.tar;*.tar.gz;*.tgz")])
+        if file_path and image_loader.is_archive(file_path):
+            # Zipped/tarred products are stacked in place, like a product folder
+            self.load_post_folder(file_path)
+            return
         if file_path:
             self.post_entry.delete(0, tk.END)
             self.post_entry.insert(0, file_path)
@@ -540,7 +551,7 @@ class TrainModelUI:
     
     def select_model_path(self):
         """Opens file dialog to select save path for the model."""
-        file_path = filedialog.asksaveasfilename(defaultextension=".pkl", filetypes=[("Pickle files", "*.pkl")])
+        file_path = filedialog.asksaveasfilename(defaultextension=".npz", filetypes=[("Compact models", "*.npz"), ("Pickle files", "*.pkl")])
         if file_path:
             self.save_model_entry.delete(0, tk.END)
             self.save_model_entry.insert(0, file_path)
@@ -735,7 +746,8 @@ class TrainModelUI:
         """Trains the model and evaluates it."""
         try:
             self.model, self.conf_matrix, self.class_report, self.accuracy = processing.train_and_evaluate_svm(
-                self.X_sampled, self.y_sampled, test_size=self.test_size
+                self.X_sampled, self.y_sampled, test_size=self.test_size,
+                bands=processing.feature_bands(self.post_image_path)
             )
 
             # Save Model if Selected
@@ -753,7 +765,7 @@ class TrainModelUI:
     def save_trained_model(self):
         """Saves the trained model and moves to metrics display."""
         try:
-            processing.save_model(self.model, self.model_save_path)
+            processing.save_model(self.model, self.model_save_path, self.satellite)
             self.update_state_label("Model Saved! Displaying Metrics...")
             self.root.after(100, self.display_training_metrics)
 
@@ -894,7 +906,9 @@ class TrainModelUI:
 
                 # Read the bands
                 r, g, b = band_indices["Red"], band_indices["Green"], band_indices["Blue"]
-                red, green, blue = src.read(r).astype(np.float32), src.read(g).astype(np.float32), src.read(b).astype(np.float32)
+                # Read at screen size: GDAL serves the preview from the internal overviews when present
+                out_shape = output_format.preview_shape(src)
+                red, green, blue = (src.read(i, out_shape=out_shape).astype(np.float32) for i in (r, g, b))
 
                 if nodata_value is not None and np.isnan(float(nodata_value)):
                     mask = np.isnan(red) | np.isnan(green) | np.isnan(blue)
@@ -939,7 +953,7 @@ class TrainModelUI:
         
 
         with rio.open(image_path) as src:
-            classified_data = src.read(1)  # Read the first band
+            classified_data = src.read(1, out_shape=output_format.preview_shape(src), masked=True)  # Preview size; NoData (255) left blank
 
             img_height, img_width = classified_data.shape  # Get image size
             aspect_ratio = img_width / img_height
@@ -985,7 +999,7 @@ class UseExistingModelUI:
         self.satellite_dropdown.bind("<<ComboboxSelected>>", self.update_cloud_methods)
 
         # Model File Selection
-        ttk.Label(root, text="Select Model File (.pkl):", width=label_width, anchor="w").grid(row=1, column=0, padx=5, pady=5, sticky="w")
+        ttk.Label(root, text="Select Model File (.npz/.pkl):", width=label_width, anchor="w").grid(row=1, column=0, padx=5, pady=5, sticky="w")
         self.model_entry = ttk.Entry(root, width=50)
         self.model_entry.grid(row=1, column=1, padx=5, pady=5)
         self.model_button = ttk.Button(root, text="...", command=self.load_model_path, width=3)
@@ -1150,13 +1164,14 @@ class UseExistingModelUI:
 
     def load_model_path(self):
         """Open file dialog to select a model file"""
-        file_path = filedialog.askopenfilename(filetypes=[("Pickle files", "*.pkl")])
+        file_path = filedialog.askopenfilename(filetypes=[("Model files", "*.npz;*.pkl")])
         if file_path:
             self.model_entry.delete(0, tk.END)
             self.model_entry.insert(0, file_path)
 
-    def load_after_folder(self):
-        folder_path = filedialog.askdirectory(title="Select a Folder")
+    def load_after_folder(self, folder_path=None):
+        if folder_path is None:
+            folder_path = filedialog.askdirectory(title="Select a Folder")
         if not folder_path:
             return
         
@@ -1181,7 +1196,11 @@ class UseExistingModelUI:
 
     def load_after_image(self):
         """Open file dialog to select after image"""
-        file_path = filedialog.askopenfilename(filetypes=[("Raster Files", "*.tif;*.tiff;*.img;*.jp2")])
+        file_path = filedialog.askopenfilename(filetypes=[("Raster Files", "*.tif;*.tiff;*.img;*.jp2;*.vrt"), ("Product Archives", "*.zip;*.tar;*.tar.gz;*.tgz")])
+        if file_path and image_loader.is_archive(file_path):
+            # Zipped/tarred products are stacked in place, like a product folder
+            self.load_after_folder(file_path)
+            return
         if file_path:
             self.after_entry.delete(0, tk.END)
             self.after_entry.insert(0, file_path)
@@ -1240,6 +1259,11 @@ class UseExistingModelUI:
         if not self.model_path or not self.after_image_path:
             messagebox.showerror("Error", "Please select a Model and an After image")
             return
+        try:
+            self.model = processing.check_model(self.model_path, self.after_image_path, self.satellite)  # Pickled models are loaded once, here
+        except Exception as e:
+            messagebox.showerror("Error", f"The model cannot classify this image: {e}")
+            return
 
         # Start with first step
         self.update_state_label("Applying masks...")
@@ -1271,7 +1295,8 @@ class UseExistingModelUI:
     def load_model(self):
         """Loads the classification model"""
         try:
-            self.model = processing.load_model(self.model_path)
+            if self.model is None:  # Compact models: check_model only read the header
+                self.model = processing.load_model(self.model_path)
         except Exception as e:
             self.update_state_label("Error loading model")
             messagebox.showerror("Error", f"Failed to load model: {e}")
@@ -1311,7 +1336,7 @@ class UseExistingModelUI:
         
 
         with rio.open(image_path) as src:
-            classified_data = src.read(1)  # Read the first band
+            classified_data = src.read(1, out_shape=output_format.preview_shape(src), masked=True)  # Preview size; NoData (255) left blank
 
             img_height, img_width = classified_data.shape  # Get image size
             aspect_ratio = img_width / img_height
@@ -1378,7 +1403,9 @@ class UseExistingModelUI:
 
                 # Read the bands
                 r, g, b = band_indices["Red"], band_indices["Green"], band_indices["Blue"]
-                red, green, blue = src.read(r).astype(np.float32), src.read(g).astype(np.float32), src.read(b).astype(np.float32)
+                # Read at screen size: GDAL serves the preview from the internal overviews when present
+                out_shape = output_format.preview_shape(src)
+                red, green, blue = (src.read(i, out_shape=out_shape).astype(np.float32) for i in (r, g, b))
 
                 if nodata_value is not None and np.isnan(float(nodata_value)):
                     mask = np.isnan(red) | np.isnan(green) | np.isnan(blue)
@@ -1594,7 +1621,7 @@ class TestModelPerformanceUI:
         self.model_frame.grid(row=3, column=0, columnspan=3, padx=10, pady=10, sticky="ew")
 
         # Load Model
-        ttk.Label(self.model_frame, text="Select Model File (.pkl):", width=label_width, anchor="w").grid(row=0, column=0, padx=5, pady=5, sticky="w")
+        ttk.Label(self.model_frame, text="Select Model File (.npz/.pkl):", width=label_width, anchor="w").grid(row=0, column=0, padx=5, pady=5, sticky="w")
         self.model_entry = ttk.Entry(self.model_frame, width=50)
         self.model_entry.grid(row=0, column=1, padx=5, pady=5)
         self.model_button = ttk.Button(self.model_frame, text="...", command=self.load_model_path, width=3)
@@ -1695,7 +1722,11 @@ class TestModelPerformanceUI:
 
 
     def load_pre_image(self):
-        file_path = filedialog.askopenfilename(filetypes=[("Raster Files", "*.tif;*.tiff;*.img;*.jp2")])
+        file_path = filedialog.askopenfilename(filetypes=[("Raster Files", "*.tif;*.tiff;*.img;*.jp2;*.vrt"), ("Product Archives", "*.zip;*.tar;*.tar.gz;*.tgz")])
+        if file_path and image_loader.is_archive(file_path):
+            # Zipped/tarred products are stacked in place, like a product folder
+            self.load_pre_folder(file_path)
+            return
         if file_path:
             self.pre_entry.delete(0, tk.END)
             self.pre_entry.insert(0, file_path)
@@ -1705,8 +1736,9 @@ class TestModelPerformanceUI:
                 self.pre_nodata_entry.delete(0, tk.END)
                 self.pre_nodata_entry.insert(0, str(detected_nodata))
     
-    def load_pre_folder(self):
-        folder_path = filedialog.askdirectory(title="Select a Folder")
+    def load_pre_folder(self, folder_path=None):
+        if folder_path is None:
+            folder_path = filedialog.askdirectory(title="Select a Folder")
         if not folder_path:
             return
         
@@ -1714,7 +1746,7 @@ class TestModelPerformanceUI:
         self.update_state_label("Generating Stacked Raster for Pre Image...")
         
         try:
-            stacked_image_path = image_loader.load_image(folder_path, satellite)
+            stacked_image_path = image_loader.load_image(folder_path, satellite, operations=image_loader.PRE_IMAGE_OPERATIONS)
             self.update_state_label("Stacked Raster for Pre Image Generated!")
             self.pre_entry.delete(0, tk.END)
             self.pre_entry.insert(0, stacked_image_path)
@@ -1796,8 +1828,9 @@ class TestModelPerformanceUI:
             self.post_preprocess_entry.grid_remove()
             self.post_preprocess_button.grid_remove()
 
-    def load_post_folder(self):
-        folder_path = filedialog.askdirectory(title="Select a Folder")
+    def load_post_folder(self, folder_path=None):
+        if folder_path is None:
+            folder_path = filedialog.askdirectory(title="Select a Folder")
         if not folder_path:
             return
         
@@ -1821,7 +1854,11 @@ class TestModelPerformanceUI:
             messagebox.showerror("Error", f"Failed to stack raster for Post Image: {e}")
 
     def load_post_image(self):
-        file_path = filedialog.askopenfilename(filetypes=[("Raster Files", "*.tif;*.tiff;*.img;*.jp2")])
+        file_path = filedialog.askopenfilename(filetypes=[("Raster Files", "*.tif;*.tiff;*.img;*.jp2;*.vrt"), ("Product Archives", "*.zip;*.tar;*.tar.gz;*.tgz")])
+        if file_path and image_loader.is_archive(file_path):
+            # Zipped/tarred products are stacked in place, like a product folder
+            self.load_post_folder(file_path)
+            return
         if file_path:
             self.post_entry.delete(0, tk.END)
             self.post_entry.insert(0, file_path)
@@ -1869,7 +1906,7 @@ class TestModelPerformanceUI:
 
     def load_model_path(self):
         """Open file dialog to select a model file"""
-        file_path = filedialog.askopenfilename(filetypes=[("Pickle files", "*.pkl")])
+        file_path = filedialog.askopenfilename(filetypes=[("Model files", "*.npz;*.pkl")])
         if file_path:
             self.model_entry.delete(0, tk.END)
             self.model_entry.insert(0, file_path)
@@ -1877,7 +1914,8 @@ class TestModelPerformanceUI:
     def load_model(self):
         """Loads the classification model"""        
         try:
-            self.model = processing.load_model(self.model_path)
+            if self.model is None:  # Compact models: check_model only read the header
+                self.model = processing.load_model(self.model_path)
         except Exception as e:
             self.update_state_label("Error loading model")
             messagebox.showerror("Error", f"Failed to load model: {e}")
@@ -1943,6 +1981,11 @@ class TestModelPerformanceUI:
         if not self.model_path:
             messagebox.showerror("Error", "Please select a model to test.")
             return
+        try:
+            self.model = processing.check_model(self.model_path, self.post_image_path, self.satellite)  # Pickled models are loaded once, here
+        except Exception as e:
+            messagebox.showerror("Error", f"The model cannot classify this image: {e}")
+            return
         
 
         self.update_state_label("Loading Model...")
@@ -2061,7 +2104,8 @@ class TestModelPerformanceUI:
         try:
             self.X_sampled, self.y_sampled = processing.create_training_set(
                 self.post_image_path, self.dNBR, method='threshold', threshold=self.threshold,
-                samples=self.samples, post_image_nodata=self.post_nodata
+                samples=self.samples, post_image_nodata=self.post_nodata,
+                bands=getattr(self.model, "bands_", None)  # Same features, in the same order, as at training time
             )
 
             self.update_state_label("Testing Model...")
@@ -2188,7 +2232,7 @@ class TestModelPerformanceUI:
         
 
         with rio.open(image_path) as src:
-            classified_data = src.read(1)  # Read the first band
+            classified_data = src.read(1, out_shape=output_format.preview_shape(src), masked=True)  # Preview size; NoData (255) left blank
 
             img_height, img_width = classified_data.shape  # Get image size
             aspect_ratio = img_width / img_height
@@ -2255,7 +2299,9 @@ class TestModelPerformanceUI:
 
                 # Read the bands
                 r, g, b = band_indices["Red"], band_indices["Green"], band_indices["Blue"]
-                red, green, blue = src.read(r).astype(np.float32), src.read(g).astype(np.float32), src.read(b).astype(np.float32)
+                # Read at screen size: GDAL serves the preview from the internal overviews when present
+                out_shape = output_format.preview_shape(src)
+                red, green, blue = (src.read(i, out_shape=out_shape).astype(np.float32) for i in (r, g, b))
 
                 if nodata_value is not None and np.isnan(float(nodata_value)):
                     mask = np.isnan(red) | np.isnan(green) | np.isnan(blue)
@@ -0,0 +1,179 @@
+import os
+import re
+import tarfile
+import zipfile
+from pathlib import Path
+
+RASTER_EXTENSIONS = (".jp2", ".tif", ".tiff", ".img")
+
+# Product archives read in place through GDAL's virtual file systems
+ARCHIVE_PREFIXES = {".zip": "/vsizip/", ".tar": "/vsitar/", ".tar.gz": "/vsitar/", ".tgz": "/vsitar/"}
+
+# Resolution tags in Sentinel-2 SAFE paths: "R10m" folders and "_10m" file suffixes
+_RESOLUTION_PATTERN = re.compile(r"(?:^|[_/\\])R?(\d+)m(?:$|[_./\\])")
+
+# Archive file inside a GDAL virtual path ("/vsizip/<archive>/<member>")
+_ARCHIVE_PATTERN = re.compile(r"(.+?\.(?:zip|tar|tar\.gz|tgz))(?:/|$)", re.IGNORECASE)
+
+# Folder index cache: resolved folder (or archive) path -> index entry (see build_band_index)
+_INDEX_CACHE = {}
+
+
+def build_band_index(folder_path):
+    """
+    Scans a product folder (or archive) once and indexes its files for band lookup.
+
+    The index is cached per folder and invalidated by directory modification times: a directory whose
+    mtime changed is listed again (that directory only) and the index is rebuilt if its file names differ.
+    Repeated loads of the same product therefore do not walk the tree again, even when an output such as
+    stacked.tif is rewritten inside the folder.
+
+    Zip and tar archives are indexed from their member listing, without extracting anything: their files
+    are returned as GDAL virtual paths (/vsizip/..., /vsitar/...), and the index is invalidated when the
+    archive's size or modification time changes.
+
+    Parameters:
+        folder_path (str or Path): Folder containing the band files (e.g. a Sentinel-2 .SAFE folder), or a
+            .zip/.tar/.tar.gz product archive.
+
+    Returns:
+        dict: Index entry with the scanned `files` (paths as strings, in walk order), what is used for
+        invalidation (`dirs` mtimes and entry names, or the `archive` stat) and a `bands` memo of the
+        candidates found for each band identifier.
+    """
+    key = str(Path(folder_path).resolve())
+
+    entry = _INDEX_CACHE.get(key)
+    if entry is not None and _is_fresh(entry):
+        return entry
+
+    if is_archive(key):
+        entry = _index_archive(key)
+        _INDEX_CACHE[key] = entry
+        return entry
+
+    files = []
+    dirs = {}
+    for dir_path, dir_names, file_names in os.walk(key):
+        dir_names.sort()  # Deterministic walk order
+        dirs[dir_path] = (os.stat(dir_path).st_mtime_ns, frozenset(dir_names + file_names))
+        files.extend(os.path.join(dir_path, name) for name in sorted(file_names))
+
+    entry = {"files": files, "dirs": dirs, "bands": {}}
+    _INDEX_CACHE[key] = entry
+    return entry
+
+
+def find_band_files(folder_path, required_bands, resolution=None):
+    """
+    Finds the file to use for each required band with a single (cached) scan of the folder.
+
+    A file matches a band if its name contains the band identifier. Raster files are preferred over other
+    files; among rasters, the one whose resolution tag (R10m, _20m, ...) equals `resolution` is preferred,
+    then the finest resolution available (e.g. R10m over R20m for B02).
+
+    Parameters:
+        folder_path (str or Path): Folder (or product archive) containing the band files.
+        required_bands (list of str): Band identifiers to look for (e.g. ["B02", "B8A", "SCL"]).
+        resolution (float, optional): Target resolution of the stack, if known.
+
+    Returns:
+        dict: Band identifier -> path of the selected file (a GDAL virtual path for archive members), in
+        `required_bands` order. Missing bands are skipped.
+    """
+    index = build_band_index(folder_path)
+
+    band_files = {}
+    for band_name in required_bands:
+        candidates = index["bands"].get(band_name)
+        if candidates is None:
+            candidates = [path for path in index["files"] if band_name in os.path.basename(path)]
+            index["bands"][band_name] = candidates
+
+        if candidates:
+            band_files[band_name] = min(candidates, key=lambda path: _candidate_rank(path, resolution))
+
+    return band_files
+
+
+def clear_band_index():
+    """Drops all cached folder indexes."""
+    _INDEX_CACHE.clear()
+
+
+def is_archive(path):
+    """Returns True if the path is a product archive (.zip, .tar, .tar.gz, .tgz)."""
+    return str(path).lower().endswith(tuple(ARCHIVE_PREFIXES))
+
+
+def physical_path(path):
+    """
+    Returns the file on disk that holds `path`.
+
+    For GDAL virtual paths into an archive (/vsizip/..., /vsitar/...) this is the archive itself,
+    otherwise the path is returned unchanged.
+    """
+    path = str(path)
+    if path.startswith(tuple(ARCHIVE_PREFIXES.values())):
+        match = _ARCHIVE_PATTERN.match(path.split("/", 2)[2])
+        if match:
+            return match.group(1)
+    return path
+
+
+def path_resolution(path):
+    """Returns the resolution tag (in metres) found in a band file path, or None."""
+    matches = _RESOLUTION_PATTERN.findall(str(path))
+    return int(matches[-1]) if matches else None
+
+
+def _candidate_rank(path, resolution):
+    """Sort key for band candidates: rasters first, then exact resolution match, then finest resolution."""
+    is_raster = os.path.splitext(path)[1].lower() in RASTER_EXTENSIONS
+    candidate_resolution = path_resolution(path)
+    if candidate_resolution is None:
+        return (not is_raster, 1, float("inf"))
+    exact_match = resolution is not None and candidate_resolution == resolution
+    return (not is_raster, 0 if exact_match else 1, candidate_resolution)
+
+
+def _index_archive(archive_path):
+    """Indexes the members of a zip/tar archive as GDAL virtual paths."""
+    prefix = next(prefix for ext, prefix in ARCHIVE_PREFIXES.items() if archive_path.lower().endswith(ext))
+    if prefix == "/vsizip/":
+        with zipfile.ZipFile(archive_path) as archive:
+            members = [info.filename for info in archive.infolist() if not info.is_dir()]
+    else:
+        with tarfile.open(archive_path) as archive:
+            members = [member.name for member in archive.getmembers() if member.isfile()]
+
+    # GDAL expects forward slashes, and a double slash before absolute POSIX paths
+    archive_vsi = prefix + Path(archive_path).as_posix()
+    files = [f"{archive_vsi}/{member.lstrip('/')}" for member in sorted(members)]
+
+    stat = os.stat(archive_path)
+    return {"files": files, "archive": (archive_path, stat.st_mtime_ns, stat.st_size), "bands": {}}
+
+
+def _is_fresh(entry):
+    """Checks that no file or folder was added to or removed from an indexed directory (or archive) since the scan."""
+    if "archive" in entry:
+        archive_path, mtime, size = entry["archive"]
+        try:
+            stat = os.stat(archive_path)
+        except OSError:
+            return False
+        return (stat.st_mtime_ns, stat.st_size) == (mtime, size)
+
+    try:
+        for dir_path, (mtime, names) in entry["dirs"].items():
+            current_mtime = os.stat(dir_path).st_mtime_ns
+            if current_mtime == mtime:
+                continue
+            # Modified directory: only a change in its entries (not a rewritten file) invalidates the index
+            if frozenset(os.listdir(dir_path)) != names:
+                return False
+            entry["dirs"][dir_path] = (current_mtime, names)
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,142 @@
+import math
+import os
+from rasterio.windows import Window
+
+DEFAULT_BLOCK_SIZE = 512  # Internal tile size (pixels) used for block-wise output
+DEFAULT_MEMORY_BUDGET_MB = 256  # Default peak memory allowed for one block of data
+
+
+def rows_per_block(width, bytes_per_pixel, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Computes how many rows fit in the memory budget, rounded down to whole tiles when at least one tile row fits.
+
+    Parameters:
+        width (int): Width of the window in pixels.
+        bytes_per_pixel (int): Bytes held in memory for every pixel of the window (all bands).
+        memory_budget_mb (float): Memory budget for one block, in megabytes.
+        block_size (int): Tile height of the output; rows are a multiple of it so windows stay tile-aligned.
+
+    Returns:
+        int: Number of rows per block. Below one tile row, as many rows as fit (at least one), so that the
+        budget is honoured rather than rounded up to a full tile row; block_windows then uses tiles instead.
+    """
+    budget_bytes = memory_budget_mb * 1024 * 1024
+    rows = int(budget_bytes // max(1, width * bytes_per_pixel))
+    if rows >= block_size:
+        return rows // block_size * block_size
+    return max(1, rows)
+
+
+def strip_windows(height, width, rows):
+    """Yields full-width windows of `rows` rows covering a raster of the given size."""
+    for row_off in range(0, height, rows):
+        yield Window(0, row_off, width, min(rows, height - row_off))
+
+
+def tile_size(bytes_per_pixel, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Side of the largest square tile that fits in the memory budget: a multiple of `block_size` when at least one
+    block fits, otherwise the largest power-of-two fraction of `block_size` that fits (at least one pixel), so that
+    smaller tiles divide the output blocks evenly.
+    """
+    side = int(math.sqrt(memory_budget_mb * 1024 * 1024 / max(1, bytes_per_pixel)))
+    if side >= block_size:
+        return side // block_size * block_size
+    size = block_size
+    while size > max(1, side):
+        size //= 2
+    return max(1, size)
+
+
+def tile_windows(height, width, size, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Yields square windows of `size` pixels (smaller at the right and bottom edges) covering a raster.
+
+    Windows smaller than `block_size` are yielded block by block: the windows of one output block come one after
+    the other and never cross its edges, so each block is complete (and flushed) before the next one is started.
+    """
+    step = max(size, block_size)
+    for block_row in range(0, height, step):
+        for block_col in range(0, width, step):
+            block_height, block_width = min(step, height - block_row), min(step, width - block_col)
+            for row_off in range(block_row, block_row + block_height, size):
+                for col_off in range(block_col, block_col + block_width, size):
+                    yield Window(col_off, row_off, min(size, block_col + block_width - col_off),
+                                 min(size, block_row + block_height - row_off))
+
+
+def block_windows(height, width, bytes_per_pixel, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Windows covering a raster, each holding at most `memory_budget_mb` at `bytes_per_pixel`, aligned on the
+    output blocks.
+
+    Full-width strips of whole tile rows are used when one tile row fits in the budget; below that, square tiles
+    from tile_size, which stay inside one output block, instead of strips cut across the blocks.
+    """
+    rows = rows_per_block(width, bytes_per_pixel, memory_budget_mb, block_size)
+    if rows >= min(block_size, height):
+        return strip_windows(height, width, rows)
+    return tile_windows(height, width, tile_size(bytes_per_pixel, memory_budget_mb, block_size), block_size)
+
+
+def scale_window(window, scale_factor, max_height, max_width):
+    """
+    Maps a window on the output grid back onto a source grid that is `scale_factor` times coarser/finer.
+
+    The result may have fractional offsets and sizes, which rasterio resolves by resampling when
+    reading with `out_shape`. It is clipped to the source extent.
+    """
+    col_off = window.col_off / scale_factor
+    row_off = window.row_off / scale_factor
+    width = min(window.width / scale_factor, max_width - col_off)
+    height = min(window.height / scale_factor, max_height - row_off)
+    return Window(col_off, row_off, width, height)
+
+
+def worker_count(max_workers, jobs, block_bytes=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """
+    Number of workers to use for `jobs` independent jobs (defaults to one per CPU core).
+
+    With `block_bytes`, the smallest block a worker holds, the count is also capped so that one such block per
+    worker fits in `memory_budget_mb`: the budget limits parallelism instead of being multiplied by it.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if block_bytes is not None:
+        max_workers = min(max_workers, int(memory_budget_mb * 1024 * 1024 // max(1, block_bytes)))
+    return max(1, min(max_workers, jobs))
+
+
+def parallel_tiles(height, width, bytes_per_pixel, max_workers=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                   tiles_per_worker=1, min_size=DEFAULT_BLOCK_SIZE, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Splits a raster into square tiles for parallel workers sharing one memory budget.
+
+    The tile size is chosen first, for one worker per core (defaults to the CPU count), but no smaller than
+    `min_size` as long as a single worker can hold tiles of that size; the number of workers is then capped by
+    the real tile size, and the tiles are enlarged again if fewer workers share the budget.
+
+    Parameters:
+        height (int): Height of the raster in pixels.
+        width (int): Width of the raster in pixels.
+        bytes_per_pixel (int): Bytes held in memory for every pixel of a tile (all bands).
+        max_workers (int, optional): Upper bound on the number of workers.
+        memory_budget_mb (float): Memory budget shared by all the workers, in megabytes.
+        tiles_per_worker (int): Tiles each worker may hold at once (e.g. one being processed and one queued).
+        min_size (int): Smallest tile side worth the per-tile overhead.
+        block_size (int): Internal tile size of the output, which the tiles stay aligned on.
+
+    Returns:
+        tuple: (workers, windows), the number of workers and the list of tile windows.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    size = tile_size(bytes_per_pixel, memory_budget_mb / (max_workers * tiles_per_worker), block_size)
+    size = max(size, min(min_size, tile_size(bytes_per_pixel, memory_budget_mb / tiles_per_worker, block_size)))
+
+    ntiles = -(-height // size) * -(-width // size)
+    workers = worker_count(max_workers, ntiles, tiles_per_worker * size * size * bytes_per_pixel, memory_budget_mb)
+    size = max(size, tile_size(bytes_per_pixel, memory_budget_mb / (workers * tiles_per_worker), block_size))
+
+    windows = list(tile_windows(height, width, size, block_size))
+    return min(workers, len(windows)), windows
@@ -0,0 +1,142 @@
+import numpy as np
+
+# Sentinel-2 quality bands
+QA60_CLOUD_BIT = 10  # Opaque clouds
+QA60_CIRRUS_BIT = 11  # Cirrus clouds
+SCL_CLOUD_CLASSES = (8, 9)  # Cloud medium / high probability
+SCL_SHADOW_CLASS = 3  # Cloud shadows
+CLOUD_PROBABILITY_THRESHOLD = 20  # MSK_CLDPRB threshold (0-100)
+
+# Landsat 8/9 QA_PIXEL band
+QA_PIXEL_CLOUD_BIT = 3
+QA_PIXEL_SHADOW_BIT = 4
+QA_PIXEL_CLOUD_CONFIDENCE_BIT = 8  # Bits 8-9
+QA_PIXEL_SHADOW_CONFIDENCE_BIT = 10  # Bits 10-11
+QA_PIXEL_HIGH_CONFIDENCE = 3
+
+# Lookup tables built by quality_lut: (source, mask_shadows, threshold) -> boolean array over all uint16 codes
+_LUTS = {}
+
+# Quality band used by each block-wise source
+SOURCE_BANDS = {
+    "probability": "MSK_CLDPRB",
+    "scl": "SCL",
+    "qa": "QA60",
+    "qa_pixel": "QA_PIXEL",
+}
+
+# Sources tried in order for each method, following the fallback order of geopre's cloud masking
+S2_METHODS = {
+    "auto": ["probability", "scl", "qa", "omnicloudmask"],
+    "standard": ["probability", "scl", "qa"],
+    "probability": ["probability"],
+    "scl": ["scl"],
+    "qa": ["qa"],
+    "omnicloudmask": ["omnicloudmask"],
+}
+S2_SHADOW_METHODS = {  # QA60 and MSK_CLDPRB cannot flag shadows
+    "auto": ["scl", "omnicloudmask"],
+    "standard": ["scl"],
+}
+LANDSAT_METHODS = {
+    "auto": ["qa_pixel", "omnicloudmask"],
+    "qa": ["qa_pixel"],
+    "omnicloudmask": ["omnicloudmask"],
+}
+
+
+def plan_cloud_mask(band_descriptions, satellite, method="auto", mask_shadows=False):
+    """
+    Chooses the cloud masking source for an image, without reading any pixel.
+
+    Parameters:
+        band_descriptions (tuple of str): Band descriptions of the image.
+        satellite (str): 'S2' for Sentinel-2 or 'L8' for Landsat 8/9.
+        method (str): Cloud masking method ('auto', 'standard', 'probability', 'scl', 'qa', 'omnicloudmask').
+        mask_shadows (bool): Whether cloud shadows must be masked too.
+
+    Returns:
+        tuple: (source, band_index) with the 1-based index of the quality band to decode block by block, or
+        ("omnicloudmask", None) when only the whole-image omnicloudmask model applies.
+    """
+    if satellite == 'S2':
+        methods = S2_SHADOW_METHODS if mask_shadows and method in S2_SHADOW_METHODS else S2_METHODS
+    elif satellite == 'L8':
+        methods = LANDSAT_METHODS
+    else:
+        raise ValueError("Invalid satellite type! Choose 'S2' for Sentinel-2 or 'L8' for Landsat 8/9.")
+
+    if method not in methods:
+        raise ValueError(f"Invalid cloud masking method '{method}' for {satellite}. Choose from {sorted(methods)}.")
+
+    descriptions = list(band_descriptions)
+    for source in methods[method]:
+        if source == "omnicloudmask":
+            return source, None
+        band_name = SOURCE_BANDS[source]
+        if band_name in descriptions:
+            return source, descriptions.index(band_name) + 1
+
+    raise ValueError(f"No valid band for cloud masking method '{method}' was found in the image.")
+
+
+def cloud_mask_block(quality, source, mask_shadows=False, threshold=CLOUD_PROBABILITY_THRESHOLD):
+    """
+    Decodes a block of a quality band into a cloud (and optionally shadow) mask.
+
+    Every quality band holds integer codes below 65,536 (uint16 at most), so the decoding is a single lookup
+    into a precomputed table of the mask value of every possible code (see quality_lut).
+
+    Parameters:
+        quality (numpy.ndarray): Block of the quality band selected by `plan_cloud_mask` (any numeric dtype holding
+            integer codes, e.g. the uint16 band itself or a float32 copy).
+        source (str): Source returned by `plan_cloud_mask` ('probability', 'scl', 'qa' or 'qa_pixel').
+        mask_shadows (bool): Whether cloud shadows are masked too (SCL and QA_PIXEL only).
+        threshold (int): Cloud probability threshold for MSK_CLDPRB.
+
+    Returns:
+        numpy.ndarray: Boolean mask, True where the pixel is cloudy (or shadowed).
+    """
+    lut = quality_lut(source, mask_shadows, threshold)
+    if quality.dtype not in (np.uint8, np.uint16):
+        quality = quality.astype(np.uint16)  # Integer codes stored as float (or signed) values
+    return lut[quality]
+
+
+def quality_lut(source, mask_shadows=False, threshold=CLOUD_PROBABILITY_THRESHOLD):
+    """
+    Returns the lookup table of a quality band decoding: a boolean array of 65,536 entries, True for the
+    codes that are cloudy (or shadowed). Tables are built once per (source, mask_shadows, threshold) and cached.
+    """
+    key = (source, bool(mask_shadows), threshold)
+    lut = _LUTS.get(key)
+    if lut is None:
+        lut = _decode_quality(np.arange(1 << 16, dtype=np.uint16), source, mask_shadows, threshold)
+        lut.setflags(write=False)
+        _LUTS[key] = lut
+    return lut
+
+
+def _decode_quality(quality, source, mask_shadows, threshold):
+    """Bitwise decoding of quality codes, used to fill the lookup tables."""
+    if source == "probability":
+        return quality >= threshold
+
+    if source == "scl":
+        mask = np.isin(quality, SCL_CLOUD_CLASSES)
+        if mask_shadows:
+            mask |= quality == SCL_SHADOW_CLASS
+        return mask
+
+    if source == "qa":
+        return (quality & ((1 << QA60_CLOUD_BIT) | (1 << QA60_CIRRUS_BIT))) != 0
+
+    if source == "qa_pixel":
+        mask = (quality & (1 << QA_PIXEL_CLOUD_BIT)) != 0
+        mask |= ((quality >> QA_PIXEL_CLOUD_CONFIDENCE_BIT) & 3) >= QA_PIXEL_HIGH_CONFIDENCE
+        if mask_shadows:
+            mask |= (quality & (1 << QA_PIXEL_SHADOW_BIT)) != 0
+            mask |= ((quality >> QA_PIXEL_SHADOW_CONFIDENCE_BIT) & 3) >= QA_PIXEL_HIGH_CONFIDENCE
+        return mask
+
+    raise ValueError(f"Cloud masking source '{source}' cannot be decoded block by block.")
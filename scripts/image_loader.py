@@ -1,23 +1,139 @@
-from scripts.stackbands import stack_bands
+from scripts.stackbands import stack_bands, default_stack_path
+from scripts.band_index import find_band_files, is_archive
+from scripts.blocks import DEFAULT_MEMORY_BUDGET_MB
+from scripts import stack_cache
+import rasterio as rio
 import os
 
-def load_image(folder_path, satellite="S2"):
-        
-        if satellite == "Sentinel-2" or satellite=="S2":
-            required_bands = [
-                "B01", "B02", "B03", "B04", "B05", "B06", "B07", "B08", "B8A", "B09", "B11", "B12",
-                "QA60", "MSK_CLDPRB", "SCL"  # Quality bands
-            ]
-        elif satellite == "Landsat 8/9" or satellite=="landsat":
-              required_bands =  [
-                "B01", "B02", "B03", "B04", "B05", "B06", "B07",
-                "QA_PIXEL"]
+# All bands stacked by default, per sensor
+ALL_BANDS = {
+    "S2": [
+        "B01", "B02", "B03", "B04", "B05", "B06", "B07", "B08", "B8A", "B09", "B11", "B12",
+        "QA60", "MSK_CLDPRB", "SCL"  # Quality bands
+    ],
+    "landsat": [
+        "B01", "B02", "B03", "B04", "B05", "B06", "B07",
+        "QA_PIXEL"],
+}
+
+# Bands needed by each downstream operation, per sensor.
+# "clouds:<method>" follows the fallback order of the cloud masking methods; "clouds" alone covers every method.
+OPERATION_BANDS = {
+    "S2": {
+        "rgb": ["B02", "B03", "B04"],
+        "nbr": ["B8A", "B12"],
+        "water": ["B03", "B08"],
+        "classify": ["B01", "B02", "B03", "B04", "B05", "B06", "B07", "B08", "B8A", "B09", "B11", "B12"],
+        "clouds:probability": ["MSK_CLDPRB"],
+        "clouds:scl": ["SCL"],
+        "clouds:qa": ["QA60"],
+        "clouds:standard": ["MSK_CLDPRB", "SCL", "QA60"],
+        "clouds:omnicloudmask": ["B02", "B03", "B04", "B8A"],
+        "clouds:auto": ["MSK_CLDPRB", "SCL", "QA60", "B02", "B03", "B04", "B8A"],
+    },
+    "landsat": {
+        "rgb": ["B02", "B03", "B04"],
+        "nbr": ["B05", "B07"],
+        "water": ["B03", "B05"],
+        "classify": ["B01", "B02", "B03", "B04", "B05", "B06", "B07"],
+        "clouds:qa": ["QA_PIXEL"],
+        "clouds:omnicloudmask": ["B02", "B03", "B04", "B05"],
+        "clouds:auto": ["QA_PIXEL", "B02", "B03", "B04", "B05"],
+    },
+}
+
+# Pre-fire images are only previewed, masked and used for NBR: they never need the classifier features
+PRE_IMAGE_OPERATIONS = ("rgb", "nbr", "water", "clouds")
+
+def sensor_name(satellite):
+    """Normalises the satellite names used by the UI and the scripts to "S2" or "landsat"."""
+    if satellite in ("Sentinel-2", "S2"):
+        return "S2"
+    if satellite in ("Landsat 8/9", "landsat", "L8"):
+        return "landsat"
+    raise ValueError("Unsupported satellite type. Use 'Sentinel-2' ('S2') or 'Landsat 8/9'('landsat').")
+
+def required_bands_for(satellite, operations=None, features=None):
+    """
+    Returns the bands to stack for a workflow.
+
+    Parameters:
+        satellite (str): "Sentinel-2"/"S2" or "Landsat 8/9"/"landsat".
+        operations (iterable of str, optional): Downstream operations: "rgb" (preview), "nbr", "water" (NDWI mask),
+            "classify" (all spectral bands), "clouds" (any cloud masking method) or "clouds:<method>".
+        features (list of str, optional): Band names used by the classifier, if they differ from all spectral bands.
+
+    Returns:
+        list of str: Required bands, in the sensor's standard stacking order. All bands if neither
+        `operations` nor `features` is given.
+    """
+    sensor = sensor_name(satellite)
+    if operations is None and features is None:
+        return list(ALL_BANDS[sensor])
+
+    needed = set(features or [])
+    for operation in operations or []:
+        if operation == "clouds":
+            # Every cloud masking method may be chosen later
+            for name, bands in OPERATION_BANDS[sensor].items():
+                if name.startswith("clouds:"):
+                    needed.update(bands)
+        elif operation in OPERATION_BANDS[sensor]:
+            needed.update(OPERATION_BANDS[sensor][operation])
         else:
-            raise ValueError("Unsupported satellite type. Use 'Sentinel-2' ('S2') or 'Landsat 8/9'('landsat').")
+            raise ValueError(f"Unknown operation '{operation}' for {sensor}. Choose from {sorted(OPERATION_BANDS[sensor])} or 'clouds'.")
+
+    return [band for band in ALL_BANDS[sensor] if band in needed] + sorted(needed - set(ALL_BANDS[sensor]))
+
+def load_image(folder_path, satellite="S2", streaming=True, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, virtual=False, max_workers=None,
+               use_cache=True, cache_dir=stack_cache.DEFAULT_CACHE_DIR, cache_max_size_mb=stack_cache.DEFAULT_MAX_SIZE_MB,
+               operations=None, features=None):
+        # `folder_path` may also be a .zip/.tar product archive: bands are then read in place, without extraction
+        # `operations`/`features` restrict the stack to the bands the workflow needs (see required_bands_for)
+
+        sensor = sensor_name(satellite)
+        required_bands = required_bands_for(sensor, operations, features)
+
+        # Every stack (full or partial) uses the grid of the full stack, since pre and post images are compared
+        # pixel by pixel; pinning it also makes all stacks pick the band files already at that resolution
+        resolution = _full_stack_resolution(folder_path, sensor)
+
+        # A virtual stack (VRT) only references the band files, so no pixel data is copied
+        if virtual or not use_cache:
+            output_format = "VRT" if virtual else "GTiff"
+            output_path = default_stack_path(folder_path, output_format)
+
+            return stack_bands(folder_path, required_bands, output_path, resolution, streaming=streaming, memory_budget_mb=memory_budget_mb,
+                               output_format=output_format, max_workers=max_workers)
+
+        # Stacks are cached by content: same band files, band list and sensor give back the same artifact
+        band_files = find_band_files(folder_path, required_bands, resolution)
+        key = stack_cache.cache_key(band_files, required_bands, sensor, resolution)
+        cached_path = stack_cache.lookup(key, cache_dir=cache_dir)
+        if cached_path is not None:
+            stack_cache.record_origin(key, default_stack_path(folder_path), cache_dir=cache_dir)
+            print(f"Using cached stacked raster {cached_path}")
+            return cached_path
+
+        output_path = stack_cache.entry_path(key, cache_dir=cache_dir)
+        temp_path = output_path.with_name(f"{key}_partial.tif")  # Renamed once complete, so a crash never leaves a bad entry
+        try:
+            stack_bands(folder_path, required_bands, temp_path, resolution, streaming=streaming, memory_budget_mb=memory_budget_mb,
+                        max_workers=max_workers)
+            os.replace(temp_path, output_path)
+            stack_cache.record_origin(key, default_stack_path(folder_path), cache_dir=cache_dir)  # Derived outputs go there
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
 
-        output_path = os.path.join(folder_path, "stacked.tif")
+        stack_cache.evict(cache_max_size_mb, cache_dir=cache_dir, keep=key)
 
-        stacked_path = stack_bands(folder_path, required_bands, output_path)
-        
-        return stacked_path
+        return str(output_path)
 
+def _full_stack_resolution(folder_path, sensor):
+    """Resolution the full stack of this product gets: stack_bands uses the resolution of the first band found."""
+    band_files = find_band_files(folder_path, ALL_BANDS[sensor])
+    if not band_files:
+        return None
+    with rio.open(next(iter(band_files.values()))) as src:
+        return src.res[0]
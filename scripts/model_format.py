@@ -0,0 +1,245 @@
+import hashlib
+import json
+import zipfile
+import numpy as np
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import MinMaxScaler
+
+MODEL_FORMAT = "burnarea-svm"
+MODEL_FORMAT_VERSION = 1
+COMPACT_KERNELS = ("linear", "rbf", "poly", "sigmoid")
+DECISION_CHUNK_ROWS = 4096  # Samples per kernel evaluation: bounds the (samples, support vectors) kernel matrix
+
+
+class CompactSVM(BaseEstimator, ClassifierMixin):
+    """
+    Binary SVM rebuilt from the arrays of a compact model file.
+
+    The decision function is evaluated with NumPy: X @ coef_ + intercept_ for linear models, or the kernel between
+    X and the support vectors times the dual coefficients for kernel SVMs, as sklearn's SVC computes it.
+
+    Compact models are inference-only: they keep what prediction needs, not the training state, so they cannot be
+    refitted or trained further (partial_fit). Keep a .pkl copy of a model that has to be trained again.
+    """
+
+    def __init__(self, kernel="linear", gamma=None, coef0=0.0, degree=3):
+        self.kernel = kernel
+        self.gamma = gamma
+        self.coef0 = coef0
+        self.degree = degree
+
+    def fit(self, X, y):
+        # Defined because sklearn only treats objects with a fit method as estimators (e.g. in Pipeline.predict)
+        raise TypeError("Compact (.npz) models are inference-only and cannot be trained. Train a new model with "
+                        "train_and_evaluate_svm, or keep a .pkl copy of a model that has to be trained further.")
+
+    def decision_function(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if self.kernel == "linear":
+            return X @ self.coef_[0] + self.intercept_[0]
+
+        scores = np.empty(len(X))
+        for start in range(0, len(X), DECISION_CHUNK_ROWS):
+            kernel = self._kernel(X[start:start + DECISION_CHUNK_ROWS])
+            scores[start:start + DECISION_CHUNK_ROWS] = kernel @ self.dual_coef_[0] + self.intercept_[0]
+        return scores
+
+    def predict(self, X):
+        return np.where(self.decision_function(X) > 0, self.classes_[1], self.classes_[0])
+
+    def _kernel(self, X):
+        """Kernel matrix between the samples X and the support vectors."""
+        products = X @ self.support_vectors_.T
+        if self.kernel == "rbf":
+            distances = (X ** 2).sum(axis=1)[:, None] + (self.support_vectors_ ** 2).sum(axis=1)[None, :] - 2 * products
+            return np.exp(-self.gamma * np.maximum(distances, 0))
+        if self.kernel == "poly":
+            return (self.gamma * products + self.coef0) ** self.degree
+        return np.tanh(self.gamma * products + self.coef0)  # sigmoid
+
+    def __sklearn_is_fitted__(self):
+        return hasattr(self, "classes_")
+
+
+def save_compact(model, model_path, satellite=None):
+    """
+    Saves a binary SVM (with its scaler) as an uncompressed .npz archive with a JSON header.
+
+    The archive holds the header and one array per parameter: the weights of linear models, or the support vectors
+    and dual coefficients of kernel SVMs, the intercept, the classes and the MinMaxScaler parameters. The header
+    records the sensor, the feature bands, the model kind and a SHA-256 checksum of the arrays. Arrays are stored
+    uncompressed so that load_compact can memory-map them.
+
+    Parameters:
+        model: Pipeline trained by train_and_evaluate_svm (scaler + SVC, LinearSVC or SGDClassifier), or a bare
+            estimator saved without its scaler.
+        model_path (str): Output path (.npz).
+        satellite (str, optional): Sensor the model was trained on ('S2' or 'L8').
+
+    Returns:
+        dict: The header written.
+    """
+    if isinstance(model, Pipeline) and model.steps[0][0] == "scaler":
+        if len(model.steps) != 2:
+            raise ValueError("Models with a kernel map cannot be saved in the compact format. Save them as .pkl.")
+        scaler, estimator = model.steps[0][1], model.steps[1][1]
+    else:
+        scaler, estimator = None, model
+
+    classes = np.asarray(estimator.classes_)
+    if len(classes) != 2:
+        raise ValueError("Only binary classifiers can be saved in the compact format.")
+
+    arrays = {"classes": classes.astype(np.float64)}
+    kernel = getattr(estimator, "kernel", "linear")
+    if kernel not in COMPACT_KERNELS:
+        raise ValueError(f"Kernel '{kernel}' cannot be saved in the compact format. Choose from {COMPACT_KERNELS}.")
+    if kernel == "linear":
+        coef = estimator.coef_.toarray() if hasattr(estimator.coef_, "toarray") else estimator.coef_
+        arrays["coef"] = np.asarray(coef, dtype=np.float64)
+    else:
+        arrays["support_vectors"] = np.asarray(estimator.support_vectors_, dtype=np.float64)
+        arrays["dual_coef"] = np.asarray(estimator.dual_coef_, dtype=np.float64)
+    arrays["intercept"] = np.asarray(estimator.intercept_, dtype=np.float64).ravel()
+
+    if scaler is not None:
+        if not isinstance(scaler, MinMaxScaler):
+            raise ValueError("Only a MinMaxScaler can be saved in the compact format.")
+        arrays.update(scaler_min=scaler.min_, scaler_scale=scaler.scale_, scaler_data_min=scaler.data_min_,
+                      scaler_data_max=scaler.data_max_)
+
+    bands = getattr(model, "bands_", None)
+    header = {
+        "format": MODEL_FORMAT,
+        "version": MODEL_FORMAT_VERSION,
+        "satellite": satellite,
+        "bands": list(bands) if bands is not None else None,
+        "n_features": int(getattr(estimator, "n_features_in_", 0)) or None,
+        "estimator": type(estimator).__name__,
+        "kernel": kernel,
+        "gamma": float(getattr(estimator, "_gamma", 0.0)) if kernel != "linear" else None,  # Resolved 'scale'/'auto'
+        "coef0": float(getattr(estimator, "coef0", 0.0)),
+        "degree": int(getattr(estimator, "degree", 3)),
+        "scaler": "minmax" if scaler is not None else None,
+        "feature_range": list(scaler.feature_range) if scaler is not None else None,
+        "scaler_samples": int(getattr(scaler, "n_samples_seen_", 0)) if scaler is not None else None,
+        "classes": classes.tolist(),
+        "arrays": {name: [array.dtype.str, list(array.shape)] for name, array in arrays.items()},
+        "checksum": _checksum(arrays),
+    }
+
+    header_bytes = np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8)
+    with open(model_path, "wb") as f:  # File object: np.savez would otherwise append ".npz" to other extensions
+        np.savez(f, header=header_bytes, **arrays)
+    return header
+
+
+def read_model_header(model_path):
+    """
+    Reads the JSON header of a compact model file, without reading its arrays.
+
+    Raises:
+        ValueError: If the file is not a compact model, or was written by a newer format version.
+    """
+    try:
+        with zipfile.ZipFile(model_path) as archive:
+            with archive.open("header.npy") as f:
+                header = json.loads(np.lib.format.read_array(f).tobytes().decode("utf-8"))
+    except (zipfile.BadZipFile, KeyError, ValueError) as e:
+        raise ValueError(f"{model_path} is not a compact model file: {e}")
+
+    if header.get("format") != MODEL_FORMAT:
+        raise ValueError(f"{model_path} is not a compact model file.")
+    if header.get("version", 0) > MODEL_FORMAT_VERSION:
+        raise ValueError(f"{model_path} uses model format version {header['version']}, "
+                         f"newer than the supported version {MODEL_FORMAT_VERSION}.")
+    return header
+
+
+def load_compact(model_path, mmap=True, verify=True):
+    """
+    Loads a compact model file written by save_compact.
+
+    Parameters:
+        model_path (str): Path of the .npz model.
+        mmap (bool): Memory-map the arrays instead of reading them: nothing is unpickled or copied, and pages are
+            read from disk as the model uses them.
+        verify (bool): Check the arrays against the header checksum (this reads them once).
+
+    Returns:
+        Pipeline or CompactSVM: The scaler and SVM as a Pipeline (with `bands_` and `satellite_` attributes), or
+        the bare SVM for models saved without a scaler.
+    """
+    header = read_model_header(model_path)
+    try:
+        with zipfile.ZipFile(model_path) as archive:
+            arrays = {name: _read_member(model_path, archive, name, mmap) for name in header["arrays"]}
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise ValueError(f"{model_path} is corrupted: {e}")
+
+    if verify and _checksum(arrays) != header["checksum"]:
+        raise ValueError(f"Checksum mismatch: {model_path} is corrupted.")
+
+    svm = CompactSVM(kernel=header["kernel"], gamma=header["gamma"], coef0=header["coef0"], degree=header["degree"])
+    svm.classes_ = arrays["classes"]
+    svm.intercept_ = arrays["intercept"]
+    if header["kernel"] == "linear":
+        svm.coef_ = arrays["coef"]
+    else:
+        svm.support_vectors_ = arrays["support_vectors"]
+        svm.dual_coef_ = arrays["dual_coef"]
+    if header["n_features"]:
+        svm.n_features_in_ = header["n_features"]
+
+    if header["scaler"] is None:
+        return svm
+
+    scaler = MinMaxScaler(feature_range=tuple(header["feature_range"]))
+    scaler.min_ = arrays["scaler_min"]
+    scaler.scale_ = arrays["scaler_scale"]
+    scaler.data_min_ = arrays["scaler_data_min"]
+    scaler.data_max_ = arrays["scaler_data_max"]
+    scaler.data_range_ = scaler.data_max_ - scaler.data_min_
+    scaler.n_features_in_ = len(scaler.scale_)
+    scaler.n_samples_seen_ = header.get("scaler_samples") or 0
+
+    model = Pipeline([("scaler", scaler), ("svm", svm)])
+    model.bands_ = header["bands"]
+    model.satellite_ = header["satellite"]
+    return model
+
+
+def _read_member(model_path, archive, name, mmap):
+    """Reads (or memory-maps, for uncompressed members) one array of an .npz archive."""
+    info = archive.getinfo(f"{name}.npy")
+    if not mmap or info.compress_type != zipfile.ZIP_STORED:
+        with archive.open(info) as f:
+            return np.lib.format.read_array(f)
+
+    with open(model_path, "rb") as f:
+        # The member data follows its local file header (30 bytes, then the file name and an extra field)
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = np.frombuffer(f.read(4), dtype="<u2")
+        f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    if dtype.hasobject or 0 in shape:
+        with archive.open(info) as f:
+            return np.lib.format.read_array(f)
+    return np.memmap(model_path, dtype=dtype, mode="r", offset=offset, shape=shape, order="F" if fortran_order else "C")
+
+
+def _checksum(arrays):
+    """SHA-256 of the arrays' names, dtypes, shapes and contents, in name order."""
+    digest = hashlib.sha256()
+    for name in sorted(arrays):
+        array = np.ascontiguousarray(arrays[name])
+        digest.update(f"{name}:{array.dtype.str}:{array.shape}".encode("utf-8"))
+        digest.update(array.tobytes())
+    return digest.hexdigest()
@@ -0,0 +1,79 @@
+import numpy as np
+import rasterio as rio
+from rasterio.enums import Resampling
+from scripts.blocks import DEFAULT_BLOCK_SIZE
+
+DEFAULT_COMPRESSION = "zstd"  # "zstd" or "deflate"
+PREVIEW_MAX_SIZE = 2048  # Largest preview dimension (pixels); previews are read from overviews when available
+
+
+def output_profile(profile, compress=DEFAULT_COMPRESSION, block_size=DEFAULT_BLOCK_SIZE, num_threads="ALL_CPUS"):
+    """
+    Returns a copy of a raster profile set up for Cloud-Optimized GeoTIFF style output.
+
+    The output is tiled, compressed with a predictor matching the data type (horizontal differencing for
+    integers, floating point for floats) and compressed on `num_threads` threads. Internal overviews are
+    added after writing with `build_overviews`.
+
+    Parameters:
+        profile (dict): Profile of the raster to write (count, dtype, width, height, crs, transform, ...).
+        compress (str): "zstd" or "deflate". None writes uncompressed tiles.
+        block_size (int): Internal tile size in pixels (multiple of 16).
+        num_threads (str or int): Threads used by GDAL for compression ("ALL_CPUS" or a number).
+
+    Returns:
+        dict: The updated profile, to be passed to rasterio.open(..., "w", **profile).
+    """
+    profile = dict(profile)
+
+    # Drop creation options inherited from the source (e.g. JPEG2000 or striped GeoTIFF settings)
+    for key in ("compress", "predictor", "zlevel", "zstd_level", "photometric", "quality", "blockxsize", "blockysize", "tiled"):
+        profile.pop(key, None)
+
+    profile.update(
+        driver="GTiff",
+        tiled=True,
+        blockxsize=block_size,
+        blockysize=block_size,
+        interleave="band",  # Band interleaving: reading a few bands only decodes those bands' tiles
+        bigtiff="IF_SAFER",
+    )
+    if compress:
+        is_float = np.issubdtype(np.dtype(profile["dtype"]), np.floating)
+        profile.update(compress=compress, predictor=3 if is_float else 2, num_threads=num_threads)
+
+    return profile
+
+
+def build_overviews(dst, resampling="average", block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Adds internal overviews to a dataset opened for writing, down to about one tile.
+
+    Parameters:
+        dst (rasterio dataset): Dataset opened in "w" or "r+" mode, after all bands were written.
+        resampling (str): Overview resampling ("average" for reflectance, "nearest"/"mode" for class labels).
+        block_size (int): Overviews are built until the smallest dimension fits in one tile.
+    """
+    factors = []
+    factor = 2
+    while min(dst.height, dst.width) / factor >= block_size / 2:
+        factors.append(factor)
+        factor *= 2
+
+    if factors:
+        with rio.Env(GDAL_NUM_THREADS="ALL_CPUS"):
+            dst.build_overviews(factors, Resampling[resampling])
+        dst.update_tags(ns="rio_overview", resampling=resampling)
+
+
+def preview_shape(src, max_size=PREVIEW_MAX_SIZE):
+    """
+    Returns the (height, width) at which to read a raster for display.
+
+    Reading with this `out_shape` lets GDAL use the closest internal overview instead of decoding
+    the full-resolution data for a screen-sized preview.
+    """
+    scale = max(src.height, src.width) / max_size
+    if scale <= 1:
+        return src.height, src.width
+    return max(1, int(src.height / scale)), max(1, int(src.width / scale))
@@ -1,8 +1,66 @@
 import geopre as gp
 import numpy as np
 import rasterio as rio
+from rasterio import shutil as rio_shutil
 import os
+import math
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from scripts.output_format import output_profile, build_overviews
+from scripts.blocks import DEFAULT_BLOCK_SIZE, DEFAULT_MEMORY_BUDGET_MB, block_windows, parallel_tiles
+from scripts.band_index import physical_path
+from scripts.stack_cache import derived_path, is_entry
+from rasterio.enums import MaskFlags
+from rasterio.windows import Window
+from scripts.cloud_masking import plan_cloud_mask, cloud_mask_block
+
+# Mask outputs of apply_masks: masked float32 copy, uint8 mask sidecar, or GDAL mask band of the image itself
+MASK_OUTPUTS = ("image", "sidecar", "internal")
+MASK_BIT_CLOUD = 1  # Sidecar bit set for cloudy (or shadowed) pixels
+MASK_BIT_WATER = 2  # Sidecar bit set for water pixels
+
+NODATA_CANDIDATES = (-9999, 0, np.nan)  # Fill values checked when the metadata has no NoData, in priority order
+NODATA_SAMPLE_BLOCKS = 16  # Interior blocks sampled by detect_nodata_from_path
+
+# Band names tried, in order, for each band role of the spectral indices
+SENSOR_BANDS = {
+    "S2": {
+        "green": ["B3", "B03"],
+        "red": ["B4", "B04"],
+        "nir": ["B8A", "B08", "B8"],  # Narrow NIR first (NBR)
+        "nir_broad": ["B8", "B08", "B8A"],  # Broad NIR first (NDWI, NDVI)
+        "swir1": ["B11"],
+        "swir2": ["B12"],
+    },
+    "L8": {
+        "green": ["B3", "B03", "SR_B3"],
+        "red": ["B4", "B04", "SR_B4"],
+        "nir": ["B5", "B05", "SR_B5"],
+        "nir_broad": ["B5", "B05", "SR_B5"],
+        "swir1": ["B6", "B06", "SR_B6"],
+        "swir2": ["B7", "B07", "SR_B7"],
+    },
+}
+
+# Spectral indices: band roles used and formula ("normalized_difference" is (first - second) / (first + second))
+SPECTRAL_INDICES = {
+    "NBR": (("nir", "swir2"), "normalized_difference"),
+    "NBR2": (("swir1", "swir2"), "normalized_difference"),
+    "NDWI": (("green", "nir_broad"), "normalized_difference"),
+    "NDVI": (("nir_broad", "red"), "normalized_difference"),
+    "BAI": (("red", "nir"), "bai"),
+    "MIRBI": (("swir1", "swir2"), "mirbi"),
+}
+
+# Digital number -> surface reflectance (scale, offset), used by the reflectance-based indices (BAI, MIRBI)
+REFLECTANCE_SCALE = {
+    "S2": (1e-4, 0.0),  # Sentinel-2 L2A
+    "L8": (2.75e-5, -0.2),  # Landsat Collection 2 Level-2
+}
+
+# Memoized detect_nodata_from_path results: (path, mtime, size) -> NoData value
+_NODATA_CACHE = {}
 
 '''
 def clip_image(source, geometry):
@@ -24,11 +82,37 @@ def clip_image(source, geometry):
 '''
 
 def mask_clouds_any(source, output_path, satellite, method, mask_shadows, nodata=np.nan):
-    if satellite == 'S2':
-        return gp.mask_clouds_S2(source, output_path, method=method, mask_shadows=mask_shadows, nodata_value=nodata)
-    elif satellite =='L8':
-        return gp.mask_clouds_landsat(source, output_path, method=method, mask_shadows=mask_shadows, nodata_value=nodata)
-    return output_path
+    if output_path is None:
+        # Derived from the original source (not a temporary copy), next to the source product for cached stacks
+        output_path = derived_path(source, "_masked")
+
+    # Quality band methods are decoded natively, block by block (see cloud_masking); only omnicloudmask, which
+    # runs a model on the whole image, goes through geopre
+    with rio.open(source) as src:
+        cloud_source, _ = plan_cloud_mask(src.descriptions, satellite, method, mask_shadows)
+    if cloud_source != "omnicloudmask":
+        return apply_masks_fused(source, output_path, satellite, mask_water=False, mask_clouds=True, method=method,
+                                 mask_shadows=mask_shadows, nodata=nodata)
+
+    # geopre copies the input profile for its output, which cannot be written with the VRT driver:
+    # hand it a temporary GeoTIFF copy of virtual stacks
+    temp_source = None
+    if is_virtual(source):
+        file_dir, file_name = os.path.split(source)
+        file_base, _ = os.path.splitext(file_name)
+        temp_source = os.path.join(file_dir, f"{file_base}_temp_materialized.tif")
+        rio_shutil.copy(source, temp_source, driver="GTiff")
+        source = temp_source
+
+    try:
+        if satellite == 'S2':
+            return gp.mask_clouds_S2(source, output_path, method=method, mask_shadows=mask_shadows, nodata_value=nodata)
+        elif satellite =='L8':
+            return gp.mask_clouds_landsat(source, output_path, method=method, mask_shadows=mask_shadows, nodata_value=nodata)
+        return output_path
+    finally:
+        if temp_source is not None and os.path.exists(temp_source):
+            os.remove(temp_source)
 
 def mask_water_any(source, output_path, satellite, ndwi_threshold, nodata=np.nan):
     if output_path is None:
@@ -37,141 +121,76 @@ def mask_water_any(source, output_path, satellite, ndwi_threshold, nodata=np.nan
         output_path = os.path.join(file_dir, f"{file_base}_temp_water_masked.tif")
 
     if satellite == 'S2':
-        return gp.mask_water_S2(source, output_path, ndwi_threshold, nodata)
+        return mask_water_S2(source, output_path, ndwi_threshold, nodata)
     elif satellite == 'L8':
-        return gp.mask_water_landsat(source, output_path, ndwi_threshold, nodata)
+        return mask_water_landsat(source, output_path, ndwi_threshold, nodata)
     return output_path
 
-def mask_water_S2(image_path, output_path = None, ndwi_threshold=0.1, nodata = np.nan):
-    # Open the input image
+def mask_water_S2(image_path, output_path = None, ndwi_threshold=0.1, nodata = np.nan, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """Masks water (NDWI from B3 and B8/B8A >= threshold) in a Sentinel-2 image, one block at a time."""
 
     if output_path is None:
         file_dir, file_name = os.path.split(image_path)
         file_base, _ = os.path.splitext(file_name)  # Ignore original extension
         output_path = os.path.join(file_dir, f"{file_base}_temp_water_masked.tif")
 
-    with rio.open(image_path) as src:
-        band_descriptions = src.descriptions  # Get band descriptions
-        image = src.read()  # Read all bands into a NumPy array
-        meta = src.meta.copy()  # Copy metadata
-
-        # Get indices for B3 (Green) and B8/B8A (NIR)
-        try:
-            if "B3" in band_descriptions:
-                b3_idx = band_descriptions.index("B3") + 1 
-            elif "B03" in band_descriptions:
-                b3_idx = band_descriptions.index("B03") + 1
-            else:
-                raise ValueError("Band 3 not found in band descriptions!")
-            if "B8" in band_descriptions:
-                b8_idx = band_descriptions.index("B8") + 1
-            elif "B08" in band_descriptions:
-                b8_idx = band_descriptions.index("B08") + 1
-            elif "B8A" in band_descriptions:
-                b8_idx = band_descriptions.index("B8A") + 1
-            else:
-                raise ValueError("Neither B8 nor B8A found in band descriptions!")
-        except ValueError as e:
-            raise ValueError(f"Required band(s) not found: {e}")
-
-        # Read Green (B3) and NIR (B8 or B8A) bands
-        green = src.read(b3_idx).astype(np.float32)
-        nir = src.read(b8_idx).astype(np.float32)
-
-        # Compute NDWI = (Green - NIR) / (Green + NIR)
-        ndwi = (green - nir) / (green + nir + 1e-10)  # Avoid division by zero
+    return apply_masks_fused(image_path, output_path, 'S2', mask_water=True, ndwi_threshold=ndwi_threshold, mask_clouds=False,
+                             nodata=nodata, memory_budget_mb=memory_budget_mb)
 
-        # Create water mask (non water: NDWI < 0.01)
-        water_mask = ndwi < 0.01
-
-        # Apply the mask to all bands
-        masked_image = np.where(water_mask, image, nodata)
-
-        # Update metadata
-        meta.update({"nodata": nodata, "dtype": 'float32'})
-
-    # Save the masked image
-    with rio.open(output_path, "w", **meta) as dest:
-        dest.write(masked_image.astype('float32'))
-        
-        # Preserve band descriptions in the output file
-        dest.descriptions = band_descriptions
-
-    return output_path  # Return the new file path for reference
-
-def mask_water_landsat(image_path, output_path = None, ndwi_threshold=0.1, nodata = np.nan):
+def mask_water_landsat(image_path, output_path = None, ndwi_threshold=0.1, nodata = np.nan, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """Masks water (NDWI from B3 and B5 >= threshold) in a Landsat 8/9 image, one block at a time."""
 
     if output_path is None:
         file_dir, file_name = os.path.split(image_path)
         file_base, _ = os.path.splitext(file_name)  # Ignore original extension
         output_path = os.path.join(file_dir, f"{file_base}_temp_water_masked.tif")
 
-    # Open the input image
-    with rio.open(image_path) as src:
-        band_descriptions = src.descriptions  # Get band descriptions
-        image = src.read()  # Read all bands into a NumPy array
-        meta = src.meta.copy()  # Copy metadata
-
-        # Get indices for Green (B3) and NIR (B5) bands in Landsat 8
-        try:
-            if "B3" in band_descriptions:
-                b3_idx = band_descriptions.index("B3") + 1  # Rasterio is 1-based
-            elif "B03" in band_descriptions:
-                b3_idx = band_descriptions.index("B03") + 1
-            elif "SR_B3" in band_descriptions:
-                b3_idx = band_descriptions.index("SR_B3") + 1
-            else:
-                raise ValueError("Band B3 not found in band descriptions!")
-
-            if "B5" in band_descriptions:
-                b5_idx = band_descriptions.index("B5") + 1
-            elif "B05" in band_descriptions:
-                b5_idx = band_descriptions.index("B05") + 1
-            elif "SR_B5" in band_descriptions:
-                b5_idx = band_descriptions.index("SR_B5") + 1
-            else:
-                raise ValueError("Band B5 not found in band descriptions!")
-        except ValueError as e:
-            raise ValueError(f"Required band(s) not found: {e}")
-
-        # Read Green (B3) and NIR (B5) bands
-        green = src.read(b3_idx).astype(np.float32)
-        nir = src.read(b5_idx).astype(np.float32)
-
-        # Compute NDWI = (Green - NIR) / (Green + NIR)
-        ndwi = (green - nir) / (green + nir + 1e-10)  # Avoid division by zero
+    return apply_masks_fused(image_path, output_path, 'L8', mask_water=True, ndwi_threshold=ndwi_threshold, mask_clouds=False,
+                             nodata=nodata, memory_budget_mb=memory_budget_mb)
+
+def apply_masks(image_path, satellite, final_output_path = None, method='auto', mask_clouds=True, mask_shadows=True, mask_water=True, ndwi_threshold=0.01, nodata=None,
+                fused=True, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, mask_output="image", max_workers=None, native_dtype=False):
+    """
+    Apply water masking first, then call the cloud masking function.
+
+    With `fused=True` (default) water and cloud masks are computed together, block by block, in a single read
+    and write of the image (see apply_masks_fused). The two-step path is only used for omnicloudmask, which
+    needs the whole image at once.
+
+    `mask_output` chooses what is produced:
+        - "image" (default): a float32 copy of the image with `nodata` in masked pixels (a copy in the image's own
+          dtype with `native_dtype=True`); returns its path.
+        - "sidecar": a uint8 mask (MASK_BIT_CLOUD | MASK_BIT_WATER, 0 = valid) next to the untouched image;
+          returns the sidecar path, to be passed as `mask_path` to compute_NBR, create_training_set and classify.
+        - "internal": the mask is stored as the GDAL mask band of the image (GeoTIFF only, not a cached stack
+          from load_image), leaving the reflectance untouched; returns the image path. Readers pick it up automatically.
+    """
+    if mask_output not in MASK_OUTPUTS:
+        raise ValueError(f"Invalid mask output '{mask_output}'. Choose from {MASK_OUTPUTS}.")
 
-        # Create water mask (water: NDWI < 0.01)
-        water_mask = ndwi < ndwi_threshold
-
-        # Apply the mask to all bands
-        masked_image = np.where(water_mask, image, nodata)
-
-        # Update metadata
-        meta.update({"nodata": nodata, "dtype": 'float32'})
-
-    # Save the masked image
-    with rio.open(output_path, "w", **meta) as dest:
-        dest.write(masked_image)
-        
-        # Preserve band descriptions in the output file
-        dest.descriptions = band_descriptions
-
-    return output_path  # Return the new file path for reference
-
-def apply_masks(image_path, satellite, final_output_path = None, method='auto', mask_clouds=True, mask_shadows=True, mask_water=True, ndwi_threshold=0.01, nodata=None):
-    """Apply water masking first, then call the cloud masking function."""
-    
     # Define the final output file (always save as .tif)
-    if final_output_path is None:
-        file_dir, file_name = os.path.split(image_path)
-        file_base, _ = os.path.splitext(file_name)  # Ignore original extension
-        final_output_path = os.path.join(file_dir, f"{file_base}_masked.tif")
+    if mask_output == "internal":
+        final_output_path = image_path
+    elif final_output_path is None:
+        # Next to the image, or next to the source product for cached stacks (always save as .tif)
+        final_output_path = derived_path(image_path, "_mask" if mask_output == "sidecar" else "_masked")
 
     final_nodata = nodata if nodata is not None else detect_nodata_from_path(image_path)
     if final_nodata is None:
         final_nodata = np.nan  # Default to NaN if no NoData was detected
 
+    if (fused or mask_output != "image") and (mask_water or mask_clouds):
+        with rio.open(image_path) as src:
+            band_descriptions = src.descriptions
+        cloud_source = plan_cloud_mask(band_descriptions, satellite, method, mask_shadows)[0] if mask_clouds else None
+        if cloud_source != "omnicloudmask":
+            return apply_masks_fused(image_path, final_output_path, satellite, mask_water=mask_water, ndwi_threshold=ndwi_threshold,
+                                     mask_clouds=mask_clouds, method=method, mask_shadows=mask_shadows, nodata=final_nodata,
+                                     memory_budget_mb=memory_budget_mb, mask_output=mask_output, max_workers=max_workers,
+                                     native_dtype=native_dtype)
+        if mask_output != "image":
+            raise ValueError("omnicloudmask needs the whole image and can only produce a masked image (mask_output='image').")
+
 
     if mask_water:
         '''
@@ -195,77 +214,442 @@ def apply_masks(image_path, satellite, final_output_path = None, method='auto',
 
     return final_output_path  # Return the final processed image
 
-def compute_NBR(source, satellite, nodata=None):
+def apply_masks_fused(image_path, output_path, satellite, mask_water=True, ndwi_threshold=0.01, mask_clouds=True, method='auto', mask_shadows=False,
+                      nodata=np.nan, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, mask_output="image", max_workers=None,
+                      native_dtype=False):
+    """
+    Masks water and clouds in a single pass over the image.
+
+    Each block is read once: the NDWI water mask and the cloud/shadow mask (decoded from the image's quality band)
+    are computed from that block and the masked block is written straight to the output, so any combination of
+    masks costs one read and one write of the scene and no temporary file.
+
+    Parameters:
+        image_path (str): Path to the stacked image.
+        output_path (str): Path of the masked output (float32 GeoTIFF with `nodata` in masked pixels), or of the
+            mask sidecar with `mask_output="sidecar"`. Ignored with `mask_output="internal"`.
+        satellite (str): 'S2' for Sentinel-2 or 'L8' for Landsat 8/9.
+        mask_water (bool): Mask pixels with NDWI >= `ndwi_threshold`.
+        ndwi_threshold (float): NDWI threshold for water, between -1 and 1.
+        mask_clouds (bool): Mask clouds using the quality band chosen for `method` (see cloud_masking.plan_cloud_mask).
+        method (str): Cloud masking method. 'omnicloudmask' is not supported block by block.
+        mask_shadows (bool): Mask cloud shadows too, when the quality band flags them.
+        nodata (float): Value written to masked pixels.
+        memory_budget_mb (float): Memory budget shared by the masking threads.
+        mask_output (str): "image", "sidecar" or "internal" (see apply_masks). The mask outputs only read the
+            Green, NIR and quality bands.
+        max_workers (int, optional): Threads masking tiles in parallel (defaults to one per CPU core).
+        native_dtype (bool): Write the masked image in the image's own dtype (e.g. uint16) instead of float32.
+            Masked pixels then hold `nodata` if the dtype can represent it, otherwise 0 (see native_nodata).
+
+    Returns:
+        str: The path of the masked output (the image itself with `mask_output="internal"`).
+    """
+    ndwi_threshold = float(ndwi_threshold)
+    if not -1.0 <= ndwi_threshold <= 1.0:
+        raise ValueError(f"Invalid NDWI threshold value: {ndwi_threshold}. Must be a float between -1 and 1.")
+
+    if mask_output == "internal":
+        output_path = image_path
+        if is_virtual(image_path) or physical_path(image_path) != str(image_path):
+            raise ValueError("An internal mask band can only be added to a GeoTIFF file; use mask_output='sidecar'.")
+        if is_entry(image_path):
+            # Cached stacks are shared by every load of the product: masking one in place would change them for all
+            raise ValueError("An internal mask band cannot be added to a cached stack; use mask_output='sidecar'.")
+
+    with rio.Env(GDAL_TIFF_INTERNAL_MASK=True), rio.open(image_path, "r+" if mask_output == "internal" else "r") as src:
+        band_descriptions = src.descriptions
+
+        # Bands to read: all of them for a masked copy, only the mask inputs otherwise
+        read_idx = list(range(1, src.count + 1)) if mask_output == "image" else []
+        if mask_water:
+            green_idx, nir_idx = ndwi_band_indices(band_descriptions, satellite)
+            read_idx += [green_idx, nir_idx]
+        if mask_clouds:
+            cloud_source, quality_idx = plan_cloud_mask(band_descriptions, satellite, method, mask_shadows)
+            if quality_idx is None:
+                raise ValueError(f"Cloud masking source '{cloud_source}' cannot be applied block by block.")
+            read_idx.append(quality_idx)
+        read_idx = sorted(set(read_idx))
+
+        meta = src.meta.copy()
+        if mask_output == "image" and native_dtype:
+            nodata = native_nodata(src.dtypes[0], nodata)
+            meta.update({"nodata": nodata})
+        elif mask_output == "image":
+            meta.update({"nodata": nodata, "dtype": 'float32'})
+        else:
+            meta.update({"count": 1, "nodata": None, "dtype": 'uint8'})
+        meta = output_profile(meta)  # Tiled, compressed GeoTIFF with internal overviews
+
+        # One block per worker holds the bands read (native dtype, plus a float32 copy for a float32 output),
+        # two single-band float32 scratch planes and the mask
+        bytes_per_pixel = len(read_idx) * (np.dtype(src.dtypes[0]).itemsize + (4 if mask_output == "image" and not native_dtype else 0)) + 2 * 4 + 1
+
+        # Tiles are processed by parallel workers (one dataset handle each), as many as can each hold a tile within
+        # the budget; an internal mask band is written through the handle being read, so it stays on a single thread
+        workers, windows = parallel_tiles(src.height, src.width, bytes_per_pixel, 1 if mask_output == "internal" else max_workers,
+                                          memory_budget_mb)
+
+        dest = src if mask_output == "internal" else rio.open(output_path, "w", **meta)
+        write_lock = threading.Lock()  # A dataset handle must not be written from several threads at once
+        readers = threading.local()
+        handles = []
+
+        def mask_window(window):
+            reader = src
+            if workers > 1:
+                if not hasattr(readers, "src"):
+                    readers.src = rio.open(image_path)
+                    handles.append(readers.src)
+                reader = readers.src
+
+            block = reader.read(read_idx, window=window)  # Each band read once, in its native dtype
+
+            flags = np.zeros(block.shape[1:], dtype=np.uint8)
+            if mask_water:
+                # Green and NIR are views of the block, cast to float32 inside the kernel only
+                water = water_mask_block(block[read_idx.index(green_idx)], block[read_idx.index(nir_idx)], ndwi_threshold)
+                flags[water] |= MASK_BIT_WATER
+            if mask_clouds:
+                # Lookup-table decoding of the quality band (see cloud_masking.quality_lut)
+                flags[cloud_mask_block(block[read_idx.index(quality_idx)], cloud_source, mask_shadows)] |= MASK_BIT_CLOUD
+
+            with write_lock:
+                if mask_output == "image":
+                    if not native_dtype:
+                        block = block.astype(np.float32, copy=False)
+                    block[:, flags != 0] = nodata  # Mask in place
+                    dest.write(block, window=window)
+                elif mask_output == "sidecar":
+                    dest.write(flags, 1, window=window)
+                else:
+                    dest.write_mask(np.where(flags == 0, 255, 0).astype(np.uint8), window=window)  # GDAL convention: 0 = masked
 
-    try:
-        with rio.open(source) as src:
-            band_descriptions = src.descriptions  # Get band descriptions
-            # Define band indices based on satellite type
-            if satellite == 'S2':  # Sentinel-2
-                nir_band = ["B8A", "B08", "B8"]  # Check for different NIR names
-                swir2_band = ["B12"]
-            elif satellite == 'L8':  # Landsat 8/9
-                nir_band = ["B5", "B05", "SR_B5"]
-                swir2_band = ["B7", "B07", "SR_B7"]
+        try:
+            if workers == 1:
+                for window in windows:
+                    mask_window(window)
             else:
-                raise ValueError("Invalid satellite type! Choose 'S2' for Sentinel-2 or 'L8' for Landsat 8/9.")
-
-            # Get correct band indices
-            nir_idx = next((band_descriptions.index(b) + 1 for b in nir_band if b in band_descriptions), None)
-            swir2_idx = next((band_descriptions.index(b) + 1 for b in swir2_band if b in band_descriptions), None)
-
-            if nir_idx is None or swir2_idx is None:
-                raise ValueError(f"Required bands not found in {satellite} image: {nir_band} & {swir2_band}")
-
-            # Read the bands
-            nir = src.read(nir_idx).astype(np.float32)
-            swir2 = src.read(swir2_idx).astype(np.float32)
-
-            if nodata is None:
-                # Try detecting nodata from image
-                nodata = detect_nodata(src.read(), src.nodata)  # Check using NIR band
-            nodata = float(nodata) if nodata is not None else None  # Convert to float if detected
-            
-            # Apply nodata masking if detected
-            if nodata is not None:
-                nir[nir == nodata] = np.nan
-                swir2[swir2 == nodata] = np.nan
-
-            # Compute NBR
-            nbr = (nir - swir2) / (nir + swir2 + 1e-10)  # Avoid division by zero
-
-            return nbr  # Return computed NBR array
-        
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    for future in [executor.submit(mask_window, window) for window in windows]:
+                        future.result()  # Re-raise worker errors
+
+            if mask_output == "image":
+                dest.descriptions = band_descriptions
+            elif mask_output == "sidecar":
+                dest.descriptions = ("mask",)
+                dest.update_tags(MASK_BIT_CLOUD=MASK_BIT_CLOUD, MASK_BIT_WATER=MASK_BIT_WATER)
+            if mask_output != "internal":
+                build_overviews(dest, resampling="average" if mask_output == "image" else "nearest")
+            elif dest.overviews(1):
+                # Rebuilt so that the existing overviews get a matching mask
+                build_overviews(dest, resampling=dest.tags(ns="rio_overview").get("resampling", "average"))
+        finally:
+            for handle in handles:
+                handle.close()
+            if dest is not src:
+                dest.close()
+
+    print(f"Masked image saved to {output_path}" if mask_output == "image" else f"Mask saved to {output_path}")
+
+    return output_path
+
+def masked_pixels(src, window=None, mask_src=None):
+    """
+    Returns the pixels masked by apply_masks in a window of an image, without a masked copy of the image.
+
+    Parameters:
+        src (rasterio dataset): The (unmasked) image. Its GDAL mask band is used if it has one (mask_output="internal").
+        window (Window, optional): Window to read; the whole image if None.
+        mask_src (rasterio dataset, optional): Open mask sidecar (mask_output="sidecar") on the same grid as `src`.
+
+    Returns:
+        numpy.ndarray or None: Boolean mask, True where the pixel is masked, or None if the image has no mask.
+    """
+    masked = None
+    if MaskFlags.per_dataset in src.mask_flag_enums[0]:
+        masked = src.read_masks(1, window=window) == 0
+    if mask_src is not None:
+        if (mask_src.height, mask_src.width) != (src.height, src.width):
+            raise ValueError(f"Mask {mask_src.name} does not match the image size {src.height}x{src.width}.")
+        sidecar = mask_src.read(1, window=window) != 0
+        masked = sidecar if masked is None else masked | sidecar
+    return masked
+
+def water_mask_block(green, nir, ndwi_threshold):
+    """Returns True where NDWI = (Green - NIR) / (Green + NIR) >= threshold."""
+    return spectral_index_block("NDWI", {"green": green, "nir_broad": nir}, None) >= ndwi_threshold
+
+def ndwi_band_indices(band_descriptions, satellite):
+    """Returns the 1-based indices of the Green and NIR bands used for NDWI water masking."""
+    if satellite not in SENSOR_BANDS:
+        raise ValueError("Invalid satellite type! Choose 'S2' for Sentinel-2 or 'L8' for Landsat 8/9.")
+    green_names, nir_names = SENSOR_BANDS[satellite]["green"], SENSOR_BANDS[satellite]["nir_broad"]
+
+    green_idx = next((band_descriptions.index(b) + 1 for b in green_names if b in band_descriptions), None)
+    nir_idx = next((band_descriptions.index(b) + 1 for b in nir_names if b in band_descriptions), None)
+    if green_idx is None or nir_idx is None:
+        raise ValueError(f"Required band(s) not found: Green {green_names} and NIR {nir_names}")
+
+    return green_idx, nir_idx
+
+def compute_NBR(source, satellite, nodata=None, mask_path=None):
+
+    try:
+        return compute_indices(source, satellite, ["NBR"], nodata, mask_path=mask_path)["NBR"]  # Return computed NBR array
+
     except Exception as e:
         print(f"Error computing NBR for {satellite}: {e}")
         return None  # Return None if an error occurs
 
+def compute_indices(source, satellite, indices=("NBR",), nodata=None, output_path=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                    mask_path=None):
+    """
+    Computes several spectral indices in a single pass over the image.
+
+    The bands needed by all requested indices are resolved from the sensor band names (see SENSOR_BANDS), then
+    each band is read once per block and every index is computed from the same block. Pixels equal to `nodata`
+    in any of the bands an index uses are NaN in that index.
+
+    Parameters:
+        source (str): Path to the (masked) stacked image.
+        satellite (str): 'S2' for Sentinel-2 or 'L8' for Landsat 8/9.
+        indices (list of str): Indices to compute, among SPECTRAL_INDICES ('NBR', 'NBR2', 'NDWI', 'NDVI', 'BAI', 'MIRBI').
+        nodata (float, optional): NoData value of the image. Detected from the file if not given.
+        output_path (str, optional): If given, the indices are written to this multi-band float32 GeoTIFF (one band
+            per index, in `indices` order, described by the index name) instead of being returned as arrays.
+        memory_budget_mb (float): Memory budget for one block.
+        mask_path (str, optional): Mask sidecar written by apply_masks(mask_output="sidecar"). Masked pixels (and
+            pixels masked by the image's own GDAL mask band) are NaN in every index.
+
+    Returns:
+        dict or str: Index name -> float32 array, or `output_path` if the indices were written to a raster.
+    """
+    if satellite not in SENSOR_BANDS:
+        raise ValueError("Invalid satellite type! Choose 'S2' for Sentinel-2 or 'L8' for Landsat 8/9.")
+    indices = list(indices)
+    unknown = [name for name in indices if name not in SPECTRAL_INDICES]
+    if unknown:
+        raise ValueError(f"Unknown spectral index {unknown}. Choose from {sorted(SPECTRAL_INDICES)}.")
+
+    with rio.open(source) as src:
+        band_descriptions = src.descriptions
+
+        # Resolve every band role used by the requested indices to a band of the image
+        roles = sorted({role for name in indices for role in SPECTRAL_INDICES[name][0]})
+        role_idx = {}
+        for role in roles:
+            names = SENSOR_BANDS[satellite][role]
+            role_idx[role] = next((band_descriptions.index(b) + 1 for b in names if b in band_descriptions), None)
+            if role_idx[role] is None:
+                raise ValueError(f"Required band not found in {satellite} image: {role} {names}")
+        read_idx = sorted(set(role_idx.values()))  # Roles sharing a band read it once
+
+        if nodata is None:
+            # Try detecting nodata from image (memoized per file, no full read)
+            nodata = detect_nodata_from_path(source)
+        nodata = float(nodata) if nodata is not None else None  # Convert to float if detected
+
+        if output_path is None:
+            results = {name: np.empty((src.height, src.width), dtype=np.float32) for name in indices}
+            dest = None
+        else:
+            meta = src.meta.copy()
+            meta.update({"count": len(indices), "dtype": 'float32', "nodata": np.nan})
+            dest = rio.open(output_path, "w", **output_profile(meta))
+
+        # One block holds the bands read (native dtype) with their NoData flags, and one float32 plane per index
+        itemsize = np.dtype(src.dtypes[0]).itemsize
+        bytes_per_pixel = len(read_idx) * (itemsize + 1) + len(indices) * 4
+
+        mask_src = rio.open(mask_path) if mask_path is not None else None
+        try:
+            for window in block_windows(src.height, src.width, bytes_per_pixel, memory_budget_mb):
+                block = src.read(read_idx, window=window)  # Each band read once, in its native dtype
+                invalid = nodata_mask(block, nodata)  # Per band
+                masked = masked_pixels(src, window, mask_src)  # Masks are applied on read
+                bands = {role: block[read_idx.index(idx)] for role, idx in role_idx.items()}
+
+                for position, name in enumerate(indices):
+                    values = spectral_index_block(name, bands, satellite)  # Cast to float32 inside the kernel
+                    if invalid is not None:
+                        # NoData in any band used by the index gives NaN
+                        for role in SPECTRAL_INDICES[name][0]:
+                            values[invalid[read_idx.index(role_idx[role])]] = np.nan
+                    if masked is not None:
+                        values[masked] = np.nan
+                    if dest is None:
+                        results[name][window.toslices()] = values
+                    else:
+                        dest.write(values, position + 1, window=window)
+
+            if dest is not None:
+                dest.descriptions = tuple(indices)
+                build_overviews(dest)
+        finally:
+            if dest is not None:
+                dest.close()
+            if mask_src is not None:
+                mask_src.close()
+
+    return results if output_path is None else output_path
+
+def spectral_index_block(name, bands, satellite):
+    """
+    Computes one spectral index on a block.
+
+    Parameters:
+        name (str): Index name (key of SPECTRAL_INDICES).
+        bands (dict): Band role -> float32 block, for the roles the index uses.
+        satellite (str): 'S2' or 'L8', for the reflectance scaling of BAI and MIRBI.
+
+    Returns:
+        numpy.ndarray: float32 block of index values.
+    """
+    roles, formula = SPECTRAL_INDICES[name]
+    if formula == "normalized_difference":
+        first, second = (bands[role] for role in roles)
+        values = np.subtract(first, second, dtype=np.float32)
+        denominator = np.add(first, second, dtype=np.float32)
+        denominator += 1e-10  # Avoid division by zero
+        np.divide(values, denominator, out=values)
+        return values
+
+    # BAI and MIRBI are defined on surface reflectance (0-1) rather than on scaled digital numbers
+    scale, offset = REFLECTANCE_SCALE[satellite]
+    reflectance = {role: bands[role] * np.float32(scale) + np.float32(offset) for role in roles}
+
+    if name == "BAI":
+        red, nir = reflectance["red"], reflectance["nir"]
+        return (1.0 / ((0.1 - red) ** 2 + (0.06 - nir) ** 2 + 1e-10)).astype(np.float32, copy=False)
+    if name == "MIRBI":
+        return (10.0 * reflectance["swir2"] - 9.8 * reflectance["swir1"] + 2.0).astype(np.float32, copy=False)
+
+    raise ValueError(f"Unknown spectral index '{name}'.")
+
+def is_virtual(image_path):
+    """Returns True if the raster is a GDAL VRT (e.g. a virtual stack that references the band files)."""
+    return str(image_path).lower().endswith(".vrt")
+
+def detect_nodata_from_path(image_path, max_samples=NODATA_SAMPLE_BLOCKS):
+    """
+    Detects the NoData value of a raster file from a sample of its blocks.
+
+    Uses the NoData value from the metadata if set. Otherwise blocks along the image edges are checked first (fill
+    values of Sentinel-2/Landsat scenes touch the edges), then a regular grid of up to `max_samples` interior blocks;
+    the search stops at the first block where a candidate fill value is confirmed. Pixels are compared in the
+    native data type. The result is memoized per (path, modification time), so every pipeline stage that needs
+    the NoData value of the same file reuses it instead of rescanning.
+    """
+    try:
+        stat = os.stat(physical_path(image_path))
+        key = (os.path.abspath(str(image_path)), stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        key = None  # Not a local file: no memoization
+
+    if key is not None and key in _NODATA_CACHE:
+        return _NODATA_CACHE[key]
 
-def detect_nodata_from_path(image_path):
     with rio.open(image_path) as src:
-        return detect_nodata(src.read(), src.nodata)
+        nodata = src.nodata
+        if nodata is None:
+            for window in _nodata_sample_windows(src.height, src.width, max_samples, src.block_shapes[0]):
+                nodata = _find_fill_value(src.read(window=window))
+                if nodata is not None:
+                    break  # Early exit: candidate confirmed
+
+    if key is not None:
+        _NODATA_CACHE[key] = nodata
+    return nodata
 
 def detect_nodata(image, metadata_nodata=None):
 
     if metadata_nodata is not None:
         return metadata_nodata  # Use NoData from metadata if provided
 
-    # Convert to float to safely check for NaNs
-    image = image.astype(np.float32)
-
-    # Check if at least one pixel has -9999 across all bands
-    if np.any(np.all(image == -9999, axis=0)):
-        return -9999  
-
-    # Check if at least one pixel has 0 across all bands
-    if np.any(np.all(image == 0, axis=0)):
-        return 0  
-
-    # Check if at least one pixel has NaN across all bands
-    if np.any(np.all(np.isnan(image), axis=0)):
-        return np.nan 
-    
-    return None # If nothing is detected
+    return _find_fill_value(image) # None if nothing is detected
+
+def nodata_mask(image, nodata):
+    """
+    Returns True where pixels of `image` equal `nodata`, comparing in the image's native dtype (no float copy).
+
+    Returns None if `nodata` is None or cannot occur in the dtype (e.g. NaN or -9999 in uint16 data).
+    """
+    if nodata is None:
+        return None
+    nodata = float(nodata)
+    if np.isnan(nodata):
+        return np.isnan(image) if np.issubdtype(image.dtype, np.floating) else None
+    if np.issubdtype(image.dtype, np.integer):
+        info = np.iinfo(image.dtype)
+        if not nodata.is_integer() or not info.min <= nodata <= info.max:
+            return None
+        return image == image.dtype.type(nodata)
+    return image == nodata
+
+def native_nodata(dtype, nodata):
+    """
+    Returns the NoData value to write masked pixels with in a raster of `dtype`: `nodata` itself if the dtype can
+    hold it, otherwise 0 (the fill value of Sentinel-2 and Landsat integer products).
+    """
+    if nodata is None or np.issubdtype(np.dtype(dtype), np.floating):
+        return nodata
+    info = np.iinfo(np.dtype(dtype))
+    nodata = float(nodata)
+    if np.isnan(nodata) or not nodata.is_integer() or not info.min <= nodata <= info.max:
+        return 0
+    return int(nodata)
+
+def _find_fill_value(image):
+    """
+    Returns the first candidate fill value (-9999, 0, NaN, in this order) found in every band of some pixel.
+
+    Works in the image's native data type: candidates the data type cannot hold are skipped, and each candidate
+    stops being checked as soon as a band rules out every pixel.
+    """
+    for candidate in NODATA_CANDIDATES:
+        if np.isnan(candidate):
+            if not np.issubdtype(image.dtype, np.floating):
+                continue
+        elif np.issubdtype(image.dtype, np.unsignedinteger) and candidate < 0:
+            continue
+
+        # Pixels equal to the candidate in all bands seen so far
+        matches = np.isnan(image[0]) if np.isnan(candidate) else image[0] == candidate
+        for band in image[1:]:
+            if not matches.any():
+                break
+            matches &= np.isnan(band) if np.isnan(candidate) else band == candidate
+        if matches.any():
+            return candidate
+
+    return None
+
+def _nodata_sample_windows(height, width, max_samples, block_shape=(DEFAULT_BLOCK_SIZE, DEFAULT_BLOCK_SIZE)):
+    """
+    Yields the windows sampled for NoData detection, each one internal block of the file: the four corner blocks
+    and the blocks in the middle of each edge first, then a grid of interior blocks.
+    """
+    block_height, block_width = min(block_shape[0], height), min(block_shape[1], width)
+    block_rows, block_cols = -(-height // block_height), -(-width // block_width)
+
+    def block(i, j):
+        row_off, col_off = i * block_height, j * block_width
+        return Window(col_off, row_off, min(block_width, width - col_off), min(block_height, height - row_off))
+
+    seen = set()
+    last_row, last_col, mid_row, mid_col = block_rows - 1, block_cols - 1, block_rows // 2, block_cols // 2
+    edges = [(0, 0), (0, last_col), (last_row, 0), (last_row, last_col),
+             (0, mid_col), (last_row, mid_col), (mid_row, 0), (mid_row, last_col)]
+
+    grid = max(1, int(math.sqrt(max_samples)))
+    interior = [(int(block_rows * (i + 0.5) / grid), int(block_cols * (j + 0.5) / grid)) for i in range(grid) for j in range(grid)]
+
+    for i, j in edges + interior:
+        if (i, j) not in seen:
+            seen.add((i, j))
+            yield block(i, j)
 
 def select_spectral_bands(band_descriptions):
     """Filters out non-spectral bands, keeping only valid reflectance bands."""
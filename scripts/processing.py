@@ -1,14 +1,34 @@
 import numpy as np
-from sklearn.utils import resample
-from sklearn.model_selection import train_test_split
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401 (enables HalvingGridSearchCV)
+from sklearn.model_selection import GridSearchCV, HalvingGridSearchCV, StratifiedKFold, train_test_split
 from sklearn.preprocessing import MinMaxScaler
-from sklearn.svm import SVC
+from sklearn.pipeline import Pipeline
+from sklearn.svm import SVC, LinearSVC
+from sklearn.linear_model import SGDClassifier
+from sklearn.kernel_approximation import Nystroem, RBFSampler
 from sklearn.metrics import confusion_matrix, classification_report, accuracy_score
 import rasterio as rio
-from scripts.preprocessing import detect_nodata, select_spectral_bands
-import os
+from rasterio.windows import Window
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from scripts.preprocessing import compute_NBR, detect_nodata_from_path, masked_pixels, nodata_mask, select_spectral_bands
+from scripts.stack_cache import derived_path
+from scripts.model_format import load_compact, read_model_header, save_compact
+from scripts.blocks import DEFAULT_MEMORY_BUDGET_MB, parallel_tiles, rows_per_block, strip_windows
+from scripts.output_format import output_profile, build_overviews
 import joblib
 
+CLASSIFIER_BACKENDS = ("svc", "linear_svc", "sgd", "nystroem", "rbf_sampler")  # See make_classifier
+KERNEL_MAP_COMPONENTS = 300  # Features of the Nystroem/RBFSampler kernel approximations
+# Default search space of tune_svm
+TUNING_GRID = [
+    {"kernel": ["linear"], "C": [0.1, 1, 10, 100]},
+    {"kernel": ["rbf"], "C": [0.1, 1, 10, 100], "gamma": ["scale", 0.1, 1, 10]},
+]
+INCREMENTAL_BACKENDS = ("sgd", "rbf_sampler")  # Backends whose classifier supports partial_fit
+INCREMENTAL_CLASSES = np.array([0.0, 1.0])  # Labels of create_training_set (unburned, burned)
+CLASS_NODATA = 255  # NoData value of classification rasters (uint8: 0 = unburned, 1 = burned)
+MAX_SAMPLING_ATTEMPTS = 4  # Draws of create_training_set before accepting fewer samples than requested
+
 
 def compute_dNBR(pre_NBR, post_NBR):
     # Ensure inputs are NumPy arrays
@@ -30,74 +50,272 @@ def compute_dNBR(pre_NBR, post_NBR):
 
     return dNBR
 
-def create_training_set(post_image_path, dNBR, method='threshold', threshold=300, ext_burned_threshold=500, ext_unburned_threshold=50, samples=5000, post_image_nodata=None):
-    # Load the post-fire image
-    with rio.open(post_image_path) as src:
-        band_descriptions = src.descriptions  # Get all band names
-        selected_bands = select_spectral_bands(band_descriptions)  # Filter spectral bands
-        band_indices = [band_descriptions.index(b) + 1 for b in selected_bands]  # Convert to 1-based index
-
-        # Read only the selected spectral bands
-        post_image = src.read(band_indices).astype(np.float32)
-        if post_image_nodata is None:
-            post_image_nodata = detect_nodata(post_image, src.nodata)
-
+def create_training_set(post_image_path, dNBR, method='threshold', threshold=300, ext_burned_threshold=500, ext_unburned_threshold=50, samples=5000, post_image_nodata=None, mask_path=None,
+                        memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, random_state=42, bands=None):
+    """
+    Samples training pixels from the post-fire image, labelled from the dNBR.
+
+    Sampling runs in two phases. First, pixel coordinates are drawn from the dNBR labels and the masks only
+    (single-band data): the dNBR is walked strip by strip and each labelled, unmasked pixel is offered to one
+    reservoir per class, so memory grows with the sample size, not with the scene. Then the feature vectors of the
+    drawn pixels are fetched from the image, decoding only the raster blocks that hold a sample (see read_pixels).
+    The sample is stratified: each class contributes in proportion to its number of valid pixels.
+
+    Parameters:
+        post_image_path (str): Path to the stacked post-fire image.
+        dNBR (numpy.ndarray): dNBR array on the image grid (NaN where the pre or post image has no data).
+        method (str): 'threshold' or 'extreme' labelling (see compute_burned_area_threshold/_extreme).
+        threshold, ext_burned_threshold, ext_unburned_threshold (float): dNBR thresholds of the labelling method.
+        samples (int): Number of training pixels to draw.
+        post_image_nodata (float, optional): NoData value of the image. Detected from the file if not given.
+        mask_path (str, optional): Mask sidecar from apply_masks, applied on read.
+        memory_budget_mb (float): Memory budget for one strip of labels.
+        random_state (int): Seed of the sampling.
+        bands (list of str, optional): Feature bands, in column order (e.g. `model.bands_` to test a trained model).
+            All spectral bands of the image, in file order, by default.
+
+    Returns:
+        tuple: (X_sampled, y_sampled), float32 features of shape (samples, bands) and the labels (0 or 1).
+    """
     if method == 'extreme':
-        burned_area = compute_burned_area_extreme(dNBR, ext_burned_threshold, ext_unburned_threshold)
+        label_block = lambda values: compute_burned_area_extreme(values, ext_burned_threshold, ext_unburned_threshold)
     elif method == 'threshold':
-        burned_area = compute_burned_area_threshold(dNBR, threshold)
+        label_block = lambda values: compute_burned_area_threshold(values, threshold)
     else: 
         raise ValueError("Invalid method! Choose 'threshold' or 'extreme'.")
-    
-    # Reshape features from (bands, height, width) to (pixels, bands)
-    features_reshaped = post_image.reshape(post_image.shape[0], -1).T  # Transpose to (pixels, bands)
-
-    # Flatten labels from (height, width) to (pixels,)
-    labels_reshaped = burned_area.flatten()
-
-    if post_image_nodata is not None:
-        post_image_nodata=float(post_image_nodata)
 
-    if post_image_nodata is not None and np.isnan(post_image_nodata):
-        valid_mask = ~np.isnan(features_reshaped).any(axis=1)
-    elif post_image_nodata is not None:
-        valid_mask = ~(features_reshaped == post_image_nodata).any(axis=1)
-    else:
-        valid_mask = np.ones(features_reshaped.shape[0], dtype=bool)  # Keep all if nodata is None
-
-    # Ensure labels (y) are not NaN
-    valid_label_mask = ~np.isnan(labels_reshaped)
-
-    # Combine both masks
-    valid_mask = valid_mask & valid_label_mask  
-
-    # Filter features and labels using valid pixels
-    X = features_reshaped[valid_mask]
-    y = labels_reshaped[valid_mask]
-
-    print(f"Extracted {X.shape[0]} valid samples with {X.shape[1]} features each.")
-
-    # Ensure we don't sample more than available data
-    samples = min(samples, X.shape[0])
+    with rio.open(post_image_path) as src:
+        band_indices = feature_band_indices(src, bands)
 
-    # Randomly sample training points
-    X_sampled, y_sampled = resample(X, y, n_samples=samples, random_state=42)
+        if np.shape(dNBR) != (src.height, src.width):
+            raise ValueError(f"Shape mismatch: dNBR {np.shape(dNBR)} and post image {(src.height, src.width)} must be the same.")
+        if post_image_nodata is None:
+            post_image_nodata = detect_nodata_from_path(post_image_path)  # Memoized per file
+
+        # Spare candidates per class replace drawn pixels whose features turn out to be NoData; if a class still
+        # falls short, the draw is repeated with more spares
+        reservoir_size = samples + samples // 4 + 16
+        for attempt in range(MAX_SAMPLING_ATTEMPTS):
+            rng = np.random.default_rng(random_state)
+
+            # Phase 1: draw pixel coordinates from the labels and the masks, strip by strip
+            counts, drawn = _draw_pixels(src, dNBR, label_block, mask_path, reservoir_size, rng, memory_budget_mb)
+
+            # Phase 2: fetch the features of the drawn pixels only, in their native dtype (e.g. uint16)
+            all_pixels = np.concatenate([np.empty(0, dtype=np.int64)] + list(drawn.values()))
+            features = read_pixels(src, band_indices, all_pixels // src.width, all_pixels % src.width)
+
+            invalid = nodata_mask(features, post_image_nodata)
+            valid_features = ~invalid.any(axis=0) if invalid is not None else np.ones(all_pixels.size, dtype=bool)
+            quotas = _class_quotas(counts, min(samples, sum(counts.values())))
+
+            # Valid drawn pixels of each class, in draw order, up to its quota
+            positions, start, short = {}, 0, 1.0
+            for label, pixels in drawn.items():
+                valid_positions = start + np.flatnonzero(valid_features[start:start + pixels.size])
+                positions[label] = valid_positions[:quotas.get(label, 0)]
+                start += pixels.size
+                if positions[label].size < quotas.get(label, 0) and counts[label] > pixels.size:
+                    short = min(short, max(valid_positions.size, 1) / pixels.size)  # Fraction of usable candidates
+            if short == 1.0:
+                break
+            reservoir_size = int(reservoir_size / short * 1.25)
+
+    total = sum(counts.values())
+    print(f"Extracted {total} valid samples with {len(band_indices)} features each.")
+
+    # Stratified draw: each class gets its share of `samples`
+    X_parts, y_parts = [np.empty((0, len(band_indices)), dtype=np.float32)], [np.empty(0)]
+    for label, label_positions in positions.items():
+        X_parts.append(features[:, label_positions].T.astype(np.float32))  # Only the sampled features are cast
+        y_parts.append(np.full(label_positions.size, label))
+
+    X_sampled, y_sampled = np.concatenate(X_parts), np.concatenate(y_parts)
+    order = rng.permutation(y_sampled.size)  # Mix the classes
+    X_sampled, y_sampled = X_sampled[order], y_sampled[order]
 
     print(f"Sampled {X_sampled.shape[0]} points for training.")
 
     return X_sampled, y_sampled
 
-def train_and_evaluate_svm(X_sampled, y_sampled, test_size=0.25, kernel="linear", random_state=42):
-
-    scaler = MinMaxScaler(feature_range=(0,1))
-    X_sampled = scaler.fit_transform(X_sampled)
-
+def _draw_pixels(src, dNBR, label_block, mask_path, reservoir_size, rng, memory_budget_mb):
+    """
+    Phase 1 of create_training_set: draws up to `reservoir_size` pixels per class from the labels and the masks.
+
+    Returns:
+        tuple: (counts, drawn), the number of labelled, unmasked pixels of each class and the flat indices of the
+        pixels drawn for it, in draw order.
+    """
+    reservoirs = {}  # Label -> {"keys": random keys, "pixels": flat pixel indices}
+    counts = {}
+
+    rows = rows_per_block(src.width, 8 + 2, memory_budget_mb)  # Labels and validity flags
+    mask_src = rio.open(mask_path) if mask_path is not None else None
+    try:
+        for window in strip_windows(src.height, src.width, rows):
+            row_off, height = int(window.row_off), int(window.height)
+            labels = label_block(dNBR[row_off:row_off + height]).ravel()
+
+            valid = ~np.isnan(labels)
+            masked = masked_pixels(src, window, mask_src)  # Sidecar or GDAL mask band
+            if masked is not None:
+                valid &= ~masked.ravel()
+
+            for label in np.unique(labels[valid]):
+                pixels = np.flatnonzero(valid & (labels == label))
+                counts[label] = counts.get(label, 0) + pixels.size
+                reservoir = reservoirs.setdefault(label, {"keys": np.empty(0), "pixels": np.empty(0, dtype=np.int64)})
+                _reservoir_add(reservoir, pixels + row_off * src.width, reservoir_size, rng)
+    finally:
+        if mask_src is not None:
+            mask_src.close()
+
+    drawn = {label: reservoir["pixels"][np.argsort(reservoir["keys"])] for label, reservoir in sorted(reservoirs.items())}
+    return counts, drawn
+
+def read_pixels(src, indexes, rows, cols):
+    """
+    Reads the values of a set of pixels, decoding only the raster blocks that contain one of them.
+
+    Pixels are grouped by internal block (tile or strip) of the dataset and each touched block is read once, so on
+    a tiled GeoTIFF a sparse sample costs a few tile reads instead of a full read of the image.
+
+    Parameters:
+        src (rasterio dataset): Open dataset.
+        indexes (list of int): 1-based band indices to read.
+        rows, cols (numpy.ndarray): Pixel coordinates.
+
+    Returns:
+        numpy.ndarray: Values of shape (bands, pixels), in the dataset's native dtype and in the order of `rows`/`cols`.
+    """
+    rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+    values = np.empty((len(indexes), rows.size), dtype=src.dtypes[indexes[0] - 1] if indexes else src.dtypes[0])
+    if not rows.size:
+        return values
+
+    block_height, block_width = src.block_shapes[indexes[0] - 1]
+    blocks_per_row = -(-src.width // block_width)
+    block_ids = (rows // block_height) * blocks_per_row + cols // block_width
+
+    order = np.argsort(block_ids, kind="stable")
+    unique_ids, starts = np.unique(block_ids[order], return_index=True)
+    for block_id, group in zip(unique_ids, np.split(order, starts[1:])):
+        row_off = int(block_id // blocks_per_row) * block_height
+        col_off = int(block_id % blocks_per_row) * block_width
+        window = Window(col_off, row_off, min(block_width, src.width - col_off), min(block_height, src.height - row_off))
+        block = src.read(indexes, window=window)
+        values[:, group] = block[:, rows[group] - row_off, cols[group] - col_off]
+
+    return values
+
+def _reservoir_add(reservoir, pixels, size, rng):
+    """
+    Offers `pixels` (flat pixel indices) of one class to its reservoir.
+
+    Every pixel gets a uniform random key and the reservoir keeps the `size` smallest keys seen so far, which is a
+    uniform sample without replacement of all the pixels offered; sorted by key, any prefix of it is one as well.
+    """
+    if size <= 0:
+        return
+    keys = rng.random(pixels.size)
+    if reservoir["keys"].size >= size:
+        candidates = keys < reservoir["keys"].max()
+        keys, pixels = keys[candidates], pixels[candidates]
+    if not pixels.size:
+        return
+
+    keys = np.concatenate([reservoir["keys"], keys])
+    pixels = np.concatenate([reservoir["pixels"], pixels])
+    if keys.size > size:
+        keep = np.argpartition(keys, size - 1)[:size]
+        keys, pixels = keys[keep], pixels[keep]
+    reservoir["keys"], reservoir["pixels"] = keys, pixels
+
+def _class_quotas(counts, samples):
+    """Splits `samples` between classes in proportion to their pixel counts (largest remainder rounding)."""
+    total = sum(counts.values())
+    if total == 0 or samples == 0:
+        return {}
+    shares = {label: samples * count / total for label, count in sorted(counts.items())}
+    quotas = {label: int(share) for label, share in shares.items()}
+    for label in sorted(shares, key=lambda label: quotas[label] - shares[label])[:samples - sum(quotas.values())]:
+        quotas[label] += 1
+    return quotas
+
+def make_classifier(backend="svc", kernel="linear", random_state=42, **params):
+    """
+    Builds an unfitted classifier pipeline: MinMaxScaler, optional kernel approximation, linear or kernel classifier.
+
+    Backends (see CLASSIFIER_BACKENDS):
+        - "svc": SVC with `kernel`; exact, but training scales quadratically or worse with the sample size.
+        - "linear_svc": LinearSVC; linear decision, trains in about linear time.
+        - "sgd": SGDClassifier with hinge loss (a linear SVM fitted by stochastic gradient descent); supports
+          partial_fit.
+        - "nystroem": Nystroem RBF feature map followed by LinearSVC; an approximate RBF SVM.
+        - "rbf_sampler": RBFSampler (random Fourier features) followed by the SGD hinge classifier.
+
+    Parameters:
+        backend (str): Classifier backend.
+        kernel (str): Kernel of the "svc" backend.
+        random_state (int): Seed of the classifier and of the kernel approximations.
+        **params: Parameters passed to the final classifier (e.g. C=10), or to the kernel map with a "kernel_map__"
+            prefix (e.g. kernel_map__n_components=500, kernel_map__gamma=0.5).
+
+    Returns:
+        sklearn.pipeline.Pipeline: Steps "scaler", optionally "kernel_map", and "svm".
+    """
+    if backend not in CLASSIFIER_BACKENDS:
+        raise ValueError(f"Invalid classifier backend '{backend}'. Choose from {sorted(CLASSIFIER_BACKENDS)}.")
+
+    map_params = {key[len("kernel_map__"):]: value for key, value in params.items() if key.startswith("kernel_map__")}
+    svm_params = {key: value for key, value in params.items() if not key.startswith("kernel_map__")}
+
+    steps = [("scaler", MinMaxScaler(feature_range=(0,1)))]
+    if backend == "svc":
+        classifier = SVC(kernel=kernel, random_state=random_state, **svm_params)
+    elif backend in ("linear_svc", "nystroem"):
+        classifier = LinearSVC(random_state=random_state, **svm_params)
+    else:
+        classifier = SGDClassifier(loss="hinge", random_state=random_state, **svm_params)
+
+    if backend == "nystroem":
+        steps.append(("kernel_map", Nystroem(kernel="rbf", n_components=KERNEL_MAP_COMPONENTS, random_state=random_state, **map_params)))
+    elif backend == "rbf_sampler":
+        steps.append(("kernel_map", RBFSampler(n_components=KERNEL_MAP_COMPONENTS, random_state=random_state, **map_params)))
+    steps.append(("svm", classifier))
+
+    return Pipeline(steps)
+
+def train_and_evaluate_svm(X_sampled, y_sampled, test_size=0.25, kernel="linear", random_state=42, bands=None, backend="svc", **params):
+    """
+    Trains the classifier and evaluates it on a held-out part of the sample.
+
+    The returned model is a scikit-learn Pipeline of the fitted MinMaxScaler and the classifier (see
+    make_classifier): saving it keeps the training scaling, which test_model and classify apply as is instead of
+    refitting a scaler on new data. The names of the feature bands are stored with it (`bands_`), so classify
+    reads the same bands from any image.
+
+    Parameters:
+        X_sampled (numpy.ndarray): Training features, (samples, bands).
+        y_sampled (numpy.ndarray): Labels.
+        test_size (float): Fraction of the sample held out for evaluation.
+        kernel (str): SVM kernel (for the "svc" backend).
+        random_state (int): Seed of the split and of the classifier.
+        bands (list of str, optional): Band names of the feature columns (see feature_bands).
+        backend (str): Classifier backend: "svc" (default), "linear_svc", "sgd", "nystroem" or "rbf_sampler".
+            The linear and approximate backends train on hundreds of thousands of samples in seconds.
+        **params: Classifier parameters (see make_classifier).
+
+    Returns:
+        tuple: (model, conf_matrix, class_report, accuracy).
+    """
     # Split sampled data into training and testing sets
     X_train, X_test, y_train, y_test = train_test_split(X_sampled, y_sampled, test_size=test_size, random_state=random_state)
 
-    # Train the SVM
-    svm = SVC(kernel=kernel, random_state=random_state)
+    # Train the scaler and the classifier together
+    svm = make_classifier(backend, kernel, random_state, **params)
     svm.fit(X_train, y_train)
+    svm.bands_ = list(bands) if bands is not None else None
 
     # Predict on test set
     y_pred = svm.predict(X_test)
@@ -117,10 +335,169 @@ def train_and_evaluate_svm(X_sampled, y_sampled, test_size=0.25, kernel="linear"
     '''
     return svm, conf_matrix, class_report, accuracy  # Return all metrics
 
+def tune_svm(X_sampled, y_sampled, param_grid=None, test_size=0.25, cv=3, halving=True, n_jobs=-1, random_state=42, bands=None):
+    """
+    Searches the SVM kernel, C and gamma by cross-validation, in parallel, and returns the best model.
+
+    The sample is split and scaled once: every candidate is cross-validated on the same pre-scaled training matrix
+    instead of refitting a scaler per fit. joblib copies it to the worker processes with each job, except above its
+    1 MB max_nbytes threshold, where it is memory-mapped once and shared. With
+    `halving=True`, successive halving first evaluates all candidates on a small part of the sample and only keeps
+    the best third for each round on three times more samples, so poor configurations are pruned early.
+
+    Parameters:
+        X_sampled (numpy.ndarray): Training features, (samples, bands).
+        y_sampled (numpy.ndarray): Labels.
+        param_grid (list of dict, optional): SVC parameter grid (defaults to TUNING_GRID).
+        test_size (float): Fraction of the sample held out for the final evaluation.
+        cv (int): Cross-validation folds.
+        halving (bool): Use successive halving instead of an exhaustive grid search.
+        n_jobs (int): Parallel jobs (-1 uses all cores).
+        random_state (int): Seed of the split, the folds and the SVM.
+        bands (list of str, optional): Band names of the feature columns (see feature_bands).
+
+    Returns:
+        tuple: (model, conf_matrix, class_report, accuracy, candidates), as train_and_evaluate_svm plus one dict per
+        evaluated candidate with its parameters, cross-validated score, training rows of each fold fit
+        ("fit_samples", which grows with the halving rounds) and mean fit/predict times (seconds), best first.
+    """
+    # Split sampled data into training and testing sets
+    X_train, X_test, y_train, y_test = train_test_split(X_sampled, y_sampled, test_size=test_size, random_state=random_state)
+
+    # Scale once: all candidates share this matrix
+    scaler = MinMaxScaler(feature_range=(0,1))
+    X_train_scaled = scaler.fit_transform(X_train)
+
+    svm = SVC(random_state=random_state)
+    folds = StratifiedKFold(n_splits=cv, shuffle=True, random_state=random_state)
+    if halving:
+        search = HalvingGridSearchCV(svm, param_grid or TUNING_GRID, factor=3, cv=folds, n_jobs=n_jobs, random_state=random_state)
+    else:
+        search = GridSearchCV(svm, param_grid or TUNING_GRID, cv=folds, n_jobs=n_jobs)
+    search.fit(X_train_scaled, y_train)
+
+    # Best candidate (refitted on the whole training split) behind the fitted scaler
+    model = Pipeline([("scaler", scaler), ("svm", search.best_estimator_)])
+    model.bands_ = list(bands) if bands is not None else None
+
+    y_pred = model.predict(X_test)
+    conf_matrix = confusion_matrix(y_test, y_pred)
+    class_report = classification_report(y_test, y_pred, output_dict=True)  # Convert to dict
+    accuracy = accuracy_score(y_test, y_pred)
+
+    # Rows each candidate was cross-validated on (a subsample per halving round), minus the held-out fold
+    results = search.cv_results_
+    resources = results["n_resources"] if "n_resources" in results else [len(y_train)] * len(results["params"])
+    candidates = [{
+        "params": results["params"][i],
+        "score": float(results["mean_test_score"][i]),
+        "fit_samples": int(resources[i]) * (cv - 1) // cv,
+        "fit_time": float(results["mean_fit_time"][i]),
+        "predict_time": float(results["mean_score_time"][i]),
+    } for i in range(len(results["params"]))]
+    candidates.sort(key=lambda candidate: (-candidate["fit_samples"], -np.nan_to_num(candidate["score"], nan=-np.inf)))
+
+    for candidate in candidates:
+        print(f"{candidate['params']}: score {candidate['score']:.4f}, fitted on {candidate['fit_samples']} samples, "
+              f"fit {candidate['fit_time']:.3f}s, predict {candidate['predict_time']:.3f}s")
+
+    return model, conf_matrix, class_report, accuracy, candidates
+
+def train_incremental(scene_pairs, satellite, method='threshold', threshold=300, ext_burned_threshold=500, ext_unburned_threshold=50,
+                      samples_per_scene=20000, batch_size=5000, test_size=0.25, backend="sgd", model=None, checkpoint_path=None,
+                      max_eval_samples=100000, random_state=42, **params):
+    """
+    Trains a classifier out of core on many fire events, one (pre, post) scene pair at a time.
+
+    For each pair, the dNBR is computed, a training sample is drawn from the post image (see create_training_set)
+    and fed in batches to a learner supporting partial_fit. The MinMaxScaler statistics are accumulated online
+    (partial_fit) before each batch is scaled, so only one scene's sample is held in memory whatever the number of
+    events. A part of each scene's sample is held out for the final evaluation (at most `max_eval_samples` rows).
+
+    Parameters:
+        scene_pairs (list of tuple): (pre_image_path, post_image_path) of each fire event.
+        satellite (str): 'S2' for Sentinel-2 or 'L8' for Landsat 8/9.
+        method, threshold, ext_burned_threshold, ext_unburned_threshold: Labelling of the samples (see create_training_set).
+        samples_per_scene (int): Training pixels drawn from each post image.
+        batch_size (int): Rows per partial_fit call.
+        test_size (float): Fraction of each scene's sample held out for evaluation.
+        backend (str): "sgd" or "rbf_sampler" (see make_classifier); their classifiers support partial_fit.
+        model (Pipeline, optional): Model to continue training: a pipeline from make_classifier with an incremental
+            backend, e.g. a checkpoint loaded from a .pkl file. Compact (.npz) models are inference-only.
+        checkpoint_path (str, optional): The model is pickled there with save_model after every scene (not .npz,
+            whose models cannot be trained further).
+        max_eval_samples (int): Cap on the held-out evaluation rows.
+        random_state (int): Seed of the sampling and of the classifier.
+        **params: Classifier parameters (see make_classifier).
+
+    Returns:
+        tuple: (model, conf_matrix, class_report, accuracy), as train_and_evaluate_svm.
+    """
+    if checkpoint_path is not None and is_compact_model(checkpoint_path):
+        raise ValueError("Compact (.npz) models cannot be trained further: save checkpoints as .pkl.")
+    if model is None:
+        if backend not in INCREMENTAL_BACKENDS:
+            raise ValueError(f"Backend '{backend}' cannot be trained incrementally. Choose from {INCREMENTAL_BACKENDS}.")
+        model = make_classifier(backend, random_state=random_state, **params)
+        model.bands_ = None
+    elif not (isinstance(model, Pipeline) and "scaler" in model.named_steps and "svm" in model.named_steps
+              and hasattr(model.named_steps["scaler"], "partial_fit") and hasattr(model.named_steps["svm"], "partial_fit")):
+        raise ValueError(f"The model cannot be trained incrementally: expected a pipeline from make_classifier with one of "
+                         f"the backends {INCREMENTAL_BACKENDS} (compact .npz models are inference-only), got {model!r}.")
+    scaler, kernel_map, classifier = model.named_steps["scaler"], model.named_steps.get("kernel_map"), model.named_steps["svm"]
+
+    rng = np.random.default_rng(random_state)
+    X_eval, y_eval = np.empty((0, 0), dtype=np.float32), np.empty(0)
+
+    for scene, (pre_image_path, post_image_path) in enumerate(scene_pairs):
+        if getattr(model, "bands_", None) is None:
+            model.bands_ = feature_bands(post_image_path)
+
+        # Sample the scene, with the model's feature bands in the model's order
+        dNBR = compute_dNBR(compute_NBR(pre_image_path, satellite), compute_NBR(post_image_path, satellite))
+        X, y = create_training_set(post_image_path, dNBR, method, threshold, ext_burned_threshold, ext_unburned_threshold,
+                                   samples=samples_per_scene, random_state=random_state + scene, bands=model.bands_)
+        del dNBR
+        if not y.size:
+            continue
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=random_state)
+
+        # Held-out rows of all scenes, capped by a random subsample
+        X_eval = np.concatenate([X_eval.reshape(-1, X.shape[1]), X_test])
+        y_eval = np.concatenate([y_eval, y_test])
+        if y_eval.size > max_eval_samples:
+            keep = rng.choice(y_eval.size, max_eval_samples, replace=False)
+            X_eval, y_eval = X_eval[keep], y_eval[keep]
+
+        # Stream the training rows in batches: update the scaler, then the classifier
+        for start in range(0, y_train.size, batch_size):
+            X_batch, y_batch = X_train[start:start + batch_size], y_train[start:start + batch_size]
+            scaler.partial_fit(X_batch)
+            X_batch = scaler.transform(X_batch)
+            if kernel_map is not None:
+                if not hasattr(kernel_map, "random_weights_"):
+                    kernel_map.fit(X_batch)  # The random feature map only depends on the number of features
+                X_batch = kernel_map.transform(X_batch)
+            classifier.partial_fit(X_batch, y_batch, classes=INCREMENTAL_CLASSES)
+
+        print(f"Trained on scene {scene + 1}/{len(scene_pairs)} ({y_train.size} samples).")
+        if checkpoint_path is not None:
+            save_model(model, checkpoint_path)
+
+    # Evaluate on the held-out rows of all scenes
+    y_pred = model.predict(X_eval)
+    conf_matrix = confusion_matrix(y_eval, y_pred)
+    class_report = classification_report(y_eval, y_pred, output_dict=True)  # Convert to dict
+    accuracy = accuracy_score(y_eval, y_pred)
+
+    return model, conf_matrix, class_report, accuracy
+
 def test_model(model, X_test, y_test):
 
-    scaler = MinMaxScaler()
-    X_test = scaler.fit_transform(X_test)
+    scaler, estimator = split_model(model)
+    if scaler is None:
+        # Models saved without their scaler: scale the test sample on its own range, as they were always used
+        X_test = MinMaxScaler().fit_transform(X_test)
 
     y_pred = model.predict(X_test)
 
@@ -130,17 +507,112 @@ def test_model(model, X_test, y_test):
 
     return conf_matrix, class_report, accuracy  # Return all metrics
 
-def save_model(model, model_path):
-
-    joblib.dump(model, model_path)
+def split_model(model):
+    """
+    Returns the (scaler, estimator) of a model.
+
+    Models trained by train_and_evaluate_svm are pipelines holding their fitted scaler; older models saved as a
+    bare estimator have no scaler (None).
+    """
+    if isinstance(model, Pipeline):
+        if model.steps[0][0] != "scaler":
+            return None, model
+        # The estimator is the rest of the pipeline (e.g. a kernel map and a linear model), or its last step alone
+        return model.steps[0][1], model[1:] if len(model.steps) > 2 else model.steps[-1][1]
+    return None, model
+
+def feature_bands(image_path):
+    """Returns the names of the spectral bands of an image used as classification features."""
+    with rio.open(image_path) as src:
+        return select_spectral_bands(src.descriptions)
+
+def feature_band_indices(src, bands=None):
+    """
+    Returns the 1-based indices of the feature bands in an open image, in the order of `bands` (the bands a model
+    was trained on), or of all its spectral bands in file order if `bands` is None.
+    """
+    band_descriptions = src.descriptions  # Get all band names
+    if bands is None:
+        bands = select_spectral_bands(band_descriptions)  # Filter spectral bands
+    missing = [b for b in bands if b not in band_descriptions]
+    if missing:
+        raise ValueError(f"Bands {missing} used by the model are missing from {src.name}.")
+    return [band_descriptions.index(b) + 1 for b in bands]  # Convert to 1-based index
+
+def save_model(model, model_path, satellite=None):
+    """
+    Saves a model. Paths ending in .npz use the compact format of scripts.model_format (weights or support vectors,
+    scaler parameters, sensor and band list with a checksum); other paths are joblib pickles. Compact models are
+    inference-only: save a .pkl to train a model further (e.g. with train_incremental).
+
+    Parameters:
+        model: Fitted model.
+        model_path (str): Output path (.npz or .pkl).
+        satellite (str, optional): Sensor the model was trained on, recorded in compact model headers.
+    """
+    if is_compact_model(model_path):
+        save_compact(model, model_path, satellite)
+    else:
+        if satellite is not None:
+            model.satellite_ = satellite  # Read back by check_model
+        joblib.dump(model, model_path)
     print(f"SVM model saved to {model_path}")
 
-def load_model(model_path):
-
-    model = joblib.load(model_path)
+def load_model(model_path, mmap=True):
+    """
+    Loads a model saved by save_model. Compact (.npz) models are memory-mapped unless `mmap` is False.
+    """
+    if is_compact_model(model_path):
+        model = load_compact(model_path, mmap=mmap)
+    else:
+        model = joblib.load(model_path)
     print(f"SVM model loaded from {model_path}")
     return model
-    
+
+def is_compact_model(model_path):
+    """Returns True if the path is a compact (.npz) model."""
+    return str(model_path).lower().endswith(".npz")
+
+def check_model(model, image_path, satellite=None):
+    """
+    Checks that a model can classify an image before the image is processed.
+
+    For compact models only the file header is read; pickled models have to be loaded to find their band list, and
+    are returned so that they are not unpickled a second time.
+
+    Parameters:
+        model (str or estimator): Path of the saved model, or a model already loaded.
+        image_path (str): Image to classify.
+        satellite (str, optional): Sensor of the image ('S2' or 'L8').
+
+    Returns:
+        The loaded model, or None for a compact model path (load it with load_model).
+
+    Raises:
+        ValueError: If the model was trained on another sensor, or on bands the image does not have.
+    """
+    is_path = not hasattr(model, "predict")
+    if is_path and is_compact_model(model):
+        header = read_model_header(model)
+        model_bands, model_satellite, n_features = header["bands"], header["satellite"], header["n_features"]
+        model = None
+    else:
+        if is_path:
+            model = load_model(model)
+        model_bands, model_satellite = getattr(model, "bands_", None), getattr(model, "satellite_", None)
+        n_features = getattr(model, "n_features_in_", None)
+
+    if satellite is not None and model_satellite is not None and satellite != model_satellite:
+        raise ValueError(f"The model was trained on {model_satellite} images, not {satellite}.")
+
+    image_bands = feature_bands(image_path)
+    if model_bands is not None:
+        missing = [band for band in model_bands if band not in image_bands]
+        if missing:
+            raise ValueError(f"The image is missing the bands the model was trained on: {missing}.")
+    elif n_features is not None and n_features != len(image_bands):
+        raise ValueError(f"The model expects {n_features} bands, the image has {len(image_bands)} spectral bands.")
+    return model
 
 def compute_burned_area_threshold(dNBR, threshold=300):
     burned_area = np.where(np.isnan(dNBR), np.nan, np.where(dNBR >= threshold, 1, 0))
@@ -152,66 +624,188 @@ def compute_burned_area_extreme(dNBR, b_threshold=500, ub_threshold=50):
     burned_area[dNBR < ub_threshold] = 0  # Unburned
     return burned_area
 
-def classify(model, post_image_path, output_path=None, nodata_value=None):
-
-    with rio.open(post_image_path) as src:
-        band_descriptions = src.descriptions  # Get all band names
-        selected_bands = select_spectral_bands(band_descriptions)  # Filter spectral bands
-        band_indices = [band_descriptions.index(b) + 1 for b in selected_bands]  # Convert to 1-based index
-
-        # Read only the selected spectral bands
-        post_image = src.read(band_indices).astype(np.float32)
-        features_meta = src.profile  # Get metadata
-
-        # Try to read NoData from metadata
-        image_nodata = src.nodata
-
+def classify(model, post_image_path, output_path=None, nodata_value=None, mask_path=None, max_workers=None,
+             memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """
+    Classifies every valid pixel of the post-fire image, tile by tile, on a pool of worker processes.
+
+    The image is split into square tiles aligned with the output's internal tiles. Each worker process reads its
+    tiles' spectral bands, scales them and runs `model.predict`; the main process writes each tile to the output
+    GeoTIFF as soon as it is done. Only a few tiles per worker are in flight at any time, so memory stays bounded
+    by `memory_budget_mb` whatever the scene size.
+
+    The output is a uint8 raster: 0 = unburned, 1 = burned, and CLASS_NODATA (255) for NoData and masked pixels.
+
+    Parameters:
+        model: Fitted classifier.
+        post_image_path (str): Path to the stacked post-fire image.
+        output_path (str, optional): Path of the classified raster ("<image>_classified.tif" by default).
+        nodata_value (float, optional): NoData value of the image. Detected from the file if not given.
+        mask_path (str, optional): Mask sidecar from apply_masks; masked pixels are classified as NoData.
+        max_workers (int, optional): Worker processes (defaults to one per CPU core). 1 classifies in this process.
+        memory_budget_mb (float): Memory budget shared by the tiles in flight.
+
+    Returns:
+        str: The path of the classified raster.
+    """
     # Detect NoData value (use user input, metadata, or guess)
-    final_nodata = nodata_value if nodata_value is not None else detect_nodata(post_image, image_nodata)
+    final_nodata = nodata_value if nodata_value is not None else detect_nodata_from_path(post_image_path)  # Memoized per file
 
     # Generate default output filename if not provided
     if output_path is None:
-            file_dir, file_name = os.path.split(post_image_path)
-            file_base, _ = os.path.splitext(file_name)
-            output_path = os.path.join(file_dir, f"{file_base}_classified.tif")
-
-    # Reshape features for classification: (bands, height, width) → (pixels, bands)
-    features_reshaped = post_image.reshape(post_image.shape[0], -1).T  # (pixels, bands)
-
-    if final_nodata is not None and np.isnan(final_nodata):
-        valid_mask = ~np.isnan(features_reshaped).any(axis=1)
-    elif final_nodata is not None:
-        valid_mask = ~(features_reshaped == final_nodata).any(axis=1)
-    else:
-        valid_mask = np.ones(features_reshaped.shape[0], dtype=bool)
-        
+            output_path = derived_path(post_image_path, "_classified")  # Next to the source product for cached stacks
 
-    # Standardize feature values
-    scaler = MinMaxScaler()
-    features_reshaped = scaler.fit_transform(features_reshaped)
-    
-
-    # Initialize an empty array for classification results
-    classified_raster = np.full(features_reshaped.shape[0], final_nodata)  # Preserve NoData
-
-    # Classify only valid pixels
-    classified_raster[valid_mask] = model.predict(features_reshaped[valid_mask])
+    with rio.open(post_image_path) as src:
+        band_indices = feature_band_indices(src, getattr(model, "bands_", None))  # Bands the model was trained on
+        features_meta = src.profile  # Get metadata
 
-    # Reshape back to raster dimensions (height, width)
-    classified_raster = classified_raster.reshape(post_image.shape[1], post_image.shape[2])
+        # Standardize feature values with the scaler fitted at training time
+        scaler, estimator = split_model(model)
+        classes = np.asarray(getattr(model, "classes_", [0, 1]))
+        if not np.all((classes >= 0) & (classes < CLASS_NODATA) & (classes == np.round(classes))):
+            raise ValueError(f"Class labels {classes.tolist()} cannot be written to a uint8 raster.")
+        if scaler is None:
+            # Models saved without their scaler: fit one on the image's per-band range, computed block by block
+            scaler = MinMaxScaler()
+            scaler.fit(_band_range(src, band_indices, memory_budget_mb).astype(np.float32))
+
+        # Tiles: the selected bands (native dtype), their float32 copy, the scaled features and the uint8 output.
+        # Two tiles are in flight per worker; tiles are sized for one worker per core (at least 128 pixels wide,
+        # below which per-tile overhead dominates), then the workers are capped by the real tile size
+        bytes_per_pixel = len(band_indices) * (np.dtype(src.dtypes[0]).itemsize + 4 + 8) + 1 + 2
+        workers, windows = parallel_tiles(src.height, src.width, bytes_per_pixel, max_workers, memory_budget_mb,
+                                          tiles_per_worker=2, min_size=128)
 
     # Update metadata for output raster
     features_meta.update({
         "driver": "GTiff",
         "count": 1,  # Single-band classification output
-        "dtype": "float32",  # Keep as float to maintain NaNs
-        "nodata": final_nodata  # Preserve detected NoData value
+        "dtype": "uint8",  # Class labels
+        "nodata": CLASS_NODATA
     })
-
-    # Save the classified raster
+    features_meta = output_profile(features_meta)  # Tiled, compressed GeoTIFF with internal overviews
+
+    config = {
+        "model": estimator,
+        "scaler": scaler,
+        "image_path": post_image_path,
+        "band_indices": band_indices,
+        "nodata": final_nodata,
+        "mask_path": mask_path,
+    }
+
+    # Save the classified raster, one tile at a time
     with rio.open(output_path, "w", **features_meta) as dst:
-        dst.write(classified_raster.astype(np.float32), 1)
+        if workers == 1:
+            _init_tile_worker(config)
+            try:
+                for window in windows:
+                    dst.write(_classify_tile(window)[1], 1, window=window)
+            finally:
+                _close_tile_worker()
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_tile_worker, initargs=(config,)) as executor:
+                pending = set()
+                for window in windows:
+                    if len(pending) >= 2 * workers:  # Bounded number of tiles in flight
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            tile_window, labels = future.result()
+                            dst.write(labels, 1, window=tile_window)
+                    pending.add(executor.submit(_classify_tile, window))
+                for future in as_completed(pending):
+                    tile_window, labels = future.result()
+                    dst.write(labels, 1, window=tile_window)
+
+        build_overviews(dst, resampling="nearest")  # Keep class labels in the overviews
 
     print(f"Classified raster saved to {output_path}")
     
     return output_path
+
+def _band_range(src, band_indices, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """Per-band minimum and maximum of the image (NaN ignored), as a (2, bands) array, computed strip by strip."""
+    rows = rows_per_block(src.width, len(band_indices) * np.dtype(src.dtypes[0]).itemsize, memory_budget_mb)
+    minimum = maximum = None
+    for window in strip_windows(src.height, src.width, rows):
+        block = src.read(band_indices, window=window).reshape(len(band_indices), -1)
+        block_min, block_max = np.nanmin(block, axis=1), np.nanmax(block, axis=1)
+        minimum = block_min if minimum is None else np.fmin(minimum, block_min)
+        maximum = block_max if maximum is None else np.fmax(maximum, block_max)
+    return np.stack([minimum, maximum])
+
+# State of a classification worker process (see classify)
+_TILE_WORKER = {}
+
+def linear_decision(model, scaler=None):
+    """
+    Collapses a fitted binary linear classifier (and the scaler applied before it) into one weight vector and bias.
+
+    Works for models exposing `coef_` and `intercept_` with a single decision function, such as SVC(kernel="linear"),
+    LinearSVC or SGDClassifier. A MinMaxScaler is folded into the weights: w . (X * scale + min) + b equals
+    (w * scale) . X + (w . min + b), so raw features can be classified without scaling them.
+
+    Returns:
+        tuple or None: (weights, bias, classes) in float32, with `classes[1]` predicted where X @ weights + bias > 0
+        and `classes[0]` elsewhere, or None if the model is not a binary linear model.
+    """
+    if getattr(model, "kernel", "linear") != "linear" or not hasattr(model, "intercept_"):
+        return None
+    try:
+        coef = np.asarray(model.coef_.toarray() if hasattr(model.coef_, "toarray") else model.coef_, dtype=np.float64)
+    except AttributeError:
+        return None  # coef_ is only defined for linear kernels
+    if coef.shape[0] != 1 or len(model.classes_) != 2:
+        return None
+
+    weights, bias = coef[0], float(np.ravel(model.intercept_)[0])
+    if scaler is not None and not isinstance(scaler, MinMaxScaler):
+        return None  # Only a MinMaxScaler is folded into the weights
+    if scaler is not None:
+        bias += float(weights @ scaler.min_)
+        weights = weights * scaler.scale_
+    return weights.astype(np.float32), np.float32(bias), model.classes_
+
+def predict_linear(decision, X):
+    """Predicts with the output of linear_decision: a matrix product and a threshold instead of the model's predict."""
+    weights, bias, classes = decision
+    scores = X @ weights
+    scores += bias
+    return np.where(scores > 0, classes[1], classes[0])
+
+def _init_tile_worker(config):
+    """Process pool initializer: keeps the model and opens the image (and mask sidecar) once per worker."""
+    _TILE_WORKER.update(config)
+    _TILE_WORKER["linear"] = linear_decision(config["model"], config["scaler"])  # Fast path for linear models
+    _TILE_WORKER["src"] = rio.open(config["image_path"])
+    _TILE_WORKER["mask_src"] = rio.open(config["mask_path"]) if config["mask_path"] is not None else None
+
+def _close_tile_worker():
+    """Closes the datasets opened by _init_tile_worker."""
+    for key in ("src", "mask_src"):
+        if _TILE_WORKER.get(key) is not None:
+            _TILE_WORKER[key].close()
+    _TILE_WORKER.clear()
+
+def _classify_tile(window):
+    """Classifies the valid pixels of one tile; returns the window and the uint8 labels (CLASS_NODATA elsewhere)."""
+    src, band_indices, nodata = _TILE_WORKER["src"], _TILE_WORKER["band_indices"], _TILE_WORKER["nodata"]
+
+    tile = src.read(band_indices, window=window)  # Native dtype (e.g. uint16)
+
+    # Valid pixels: no band equals NoData (compared in the native dtype) and not masked
+    invalid = nodata_mask(tile, nodata)
+    valid_mask = ~invalid.any(axis=0) if invalid is not None else np.ones(tile.shape[1:], dtype=bool)
+    masked = masked_pixels(src, window, _TILE_WORKER["mask_src"])
+    if masked is not None:
+        valid_mask &= ~masked
+
+    labels = np.full(tile.shape[1:], CLASS_NODATA, dtype=np.uint8)
+    if valid_mask.any():
+        features = tile[:, valid_mask].T.astype(np.float32)  # (pixels, bands)
+        if _TILE_WORKER["linear"] is not None:
+            labels[valid_mask] = predict_linear(_TILE_WORKER["linear"], features)  # Scaler folded into the weights
+        else:
+            labels[valid_mask] = _TILE_WORKER["model"].predict(_TILE_WORKER["scaler"].transform(features))
+
+    return window, labels
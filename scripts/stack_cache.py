@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from scripts.band_index import physical_path
+
+# Cache location and size cap, overridable through environment variables
+DEFAULT_CACHE_DIR = Path(os.environ.get("BURNAREA_CACHE_DIR", Path.home() / ".cache" / "burnarea-classifier" / "stacks"))
+DEFAULT_MAX_SIZE_MB = float(os.environ.get("BURNAREA_CACHE_MAX_MB", 20 * 1024))
+
+# Files of a cache entry: the stack and its own sidecars ("<key>.tif", "<key>.json", "<key>.tif.aux.xml", ...)
+_ENTRY_PATTERN = re.compile(r"^([0-9a-f]{64})(\.[\w.]+)?$")
+
+
+def cache_key(band_files, required_bands, satellite, resolution=None, output_format="GTiff"):
+    """
+    Computes the content key of a stack.
+
+    The key covers everything the stacked artifact depends on: every input band file (absolute path, size
+    and modification time of the file, or of the archive holding it), the requested band list, the target
+    resolution, the sensor and the output format.
+
+    Parameters:
+        band_files (dict): Band identifier -> path of the band file, as selected for stacking.
+        required_bands (list of str): Requested band identifiers.
+        satellite (str): Sensor identifier.
+        resolution (float, optional): Target resolution of the stack.
+        output_format (str): Output format of the stack.
+
+    Returns:
+        str: Hex SHA-256 digest identifying the stack.
+    """
+    files = []
+    for band_name, band_path in band_files.items():
+        stat = os.stat(physical_path(band_path))  # The archive itself for members of a zip/tar product
+        files.append([band_name, str(band_path), stat.st_size, stat.st_mtime_ns])
+
+    payload = {
+        "files": files,
+        "bands": list(required_bands),
+        "satellite": satellite,
+        "resolution": resolution,
+        "format": output_format,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def entry_path(key, extension=".tif", cache_dir=DEFAULT_CACHE_DIR):
+    """Returns the path of the cached artifact for `key` (creating the cache folder if needed)."""
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir / f"{key}{extension}"
+
+
+def record_origin(key, stack_path, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Records where the stack of a cache entry would have been written without the cache (see
+    stackbands.default_stack_path), so that files derived from the entry can be written next to the source product.
+    """
+    origin_path = Path(cache_dir) / f"{key}.json"
+    if not origin_path.is_file():
+        origin_path.write_text(json.dumps({"stack_path": str(stack_path)}), encoding="utf-8")
+
+
+def derived_path(image_path, suffix, extension=".tif"):
+    """
+    Returns the default path of a file derived from an image, e.g. "<image>_masked.tif" for suffix "_masked".
+
+    For a cached stack the file goes next to the source product instead ("stacked_masked.tif" in the product
+    folder), never into the cache folder, where it would have a hashed name and could be evicted.
+    """
+    image_path = Path(image_path)
+    origin_path = image_path.with_suffix(".json")
+    if _ENTRY_PATTERN.match(image_path.name) and origin_path.is_file():
+        image_path = Path(json.loads(origin_path.read_text(encoding="utf-8"))["stack_path"])
+    return str(image_path.with_name(f"{image_path.stem}{suffix}{extension}"))
+
+
+def is_entry(path):
+    """Returns True if the path is a cached stack ("<key>.tif"), which must never be modified in place."""
+    path = Path(str(path))
+    return path.suffix == ".tif" and _ENTRY_PATTERN.match(path.name) is not None
+
+
+def lookup(key, extension=".tif", cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Returns the cached artifact for `key`, or None on a cache miss.
+
+    A hit refreshes the entry's modification time, which is what the LRU eviction orders on.
+    """
+    path = Path(cache_dir) / f"{key}{extension}"
+    if not path.is_file():
+        return None
+    os.utime(path, None)
+    return str(path)
+
+
+def evict(max_size_mb=DEFAULT_MAX_SIZE_MB, cache_dir=DEFAULT_CACHE_DIR, keep=None):
+    """
+    Removes the least recently used entries until the cache fits in `max_size_mb`.
+
+    An entry is the stack and its own sidecars ("<key>.tif", "<key>.json", GDAL's "<key>.tif.aux.xml"). Any other
+    file in the folder (e.g. an output a user wrote there explicitly) is neither counted nor removed.
+
+    Parameters:
+        max_size_mb (float): Size cap of the cache folder, in MB.
+        cache_dir (str or Path): Cache folder.
+        keep (str, optional): Key that must not be evicted (e.g. the entry just written).
+    """
+    cache_dir = Path(cache_dir)
+    if not cache_dir.is_dir():
+        return
+
+    entries = {}  # key -> {"files": [...], "size": bytes, "last_used": mtime}
+    for path in cache_dir.iterdir():
+        match = _ENTRY_PATTERN.match(path.name)
+        if not match or not path.is_file():
+            continue
+        stat = path.stat()
+        entry = entries.setdefault(match.group(1), {"files": [], "size": 0, "last_used": 0})
+        entry["files"].append(path)
+        entry["size"] += stat.st_size
+        entry["last_used"] = max(entry["last_used"], stat.st_mtime)
+
+    total = sum(entry["size"] for entry in entries.values())
+    max_bytes = max_size_mb * 1024 * 1024
+
+    # Oldest entries first
+    for key, entry in sorted(entries.items(), key=lambda item: item[1]["last_used"]):
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        for path in entry["files"]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        total -= entry["size"]
+        print(f"Evicted cached stack {key[:12]} ({entry['size'] / 1024 / 1024:.1f} MB)")
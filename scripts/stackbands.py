@@ -1,18 +1,45 @@
 import numpy as np
 import rasterio as rio
 from pathlib import Path
+import xml.etree.ElementTree as ET
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from rasterio.profiles import DefaultGTiffProfile
 from typing import Union, List
+from scripts.band_index import ARCHIVE_PREFIXES, find_band_files, is_archive
+from scripts.blocks import DEFAULT_BLOCK_SIZE, DEFAULT_MEMORY_BUDGET_MB, block_windows, scale_window, worker_count
+from scripts.output_format import output_profile, build_overviews
 
-def stack_bands(input_path: Union[Path, str], required_bands: List[str], output_path: Union[Path, str] = None, resolution: float = None) -> str:
+# NumPy dtype name -> GDAL data type name, as written in VRT files
+_GDAL_DATA_TYPES = {
+    "uint8": "Byte",
+    "int8": "Int8",
+    "uint16": "UInt16",
+    "int16": "Int16",
+    "uint32": "UInt32",
+    "int32": "Int32",
+    "float32": "Float32",
+    "float64": "Float64",
+}
+
+def stack_bands(input_path: Union[Path, str], required_bands: List[str], output_path: Union[Path, str] = None, resolution: float = None,
+                streaming: bool = False, memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB, output_format: str = "GTiff",
+                resampling: str = "nearest", max_workers: int = None) -> str:
     """
     Stacks multiple raster bands into a single multi-band raster.
 
     Parameters:
-        input_path (str or Path): Path to the folder containing band files.
+        input_path (str or Path): Path to the folder containing band files, or to a .zip/.tar product archive (read in place, without extraction).
         required_bands (list of str): List of band name identifiers (e.g., ["B4", "B3", "B2"]).
-        output_path (str or Path, optional): Path to save the stacked raster. If not provided, it is saved in the same directory as `input_path` with the name "stacked.tif".
+        output_path (str or Path, optional): Path to save the stacked raster. If not provided, it is saved in the same directory as `input_path` with the name "stacked.tif" ("stacked.vrt" for VRT output); for a product archive, next to the archive as "<name>_stacked.tif".
         resolution (float, optional): Target resolution for resampling. If None, the highest resolution available is used.
+        streaming (bool, optional): If True, bands are read, resampled and written block by block instead of being
+            loaded in memory, so peak memory is bounded by `memory_budget_mb` instead of by the scene size.
+        memory_budget_mb (float, optional): Memory budget (in MB) for one block when `streaming` is True.
+        output_format (str, optional): "GTiff" to write the stacked pixels, or "VRT" to write a virtual raster that
+            references the original band files without copying them.
+        resampling (str, optional): GDAL resampling method declared in the VRT for bands at a different resolution.
+        max_workers (int, optional): Number of threads decoding band files concurrently. Defaults to the number of CPU cores.
 
     Returns:
         str: The path to the saved stacked output raster.
@@ -21,92 +48,51 @@ def stack_bands(input_path: Union[Path, str], required_bands: List[str], output_
 
     # Set default output path if not provided
     if output_path is None:
-        output_path = input_path / "stacked.tif"
+        output_path = default_stack_path(input_path, output_format)
 
-    # Dictionary to store found band files
-    band_files = {}
     found_bands = []
     dtypes = set()
     
-    # Iterate through the required bands and search for corresponding files
+    # Look up the file of every required band with a single (cached) scan of the folder
+    band_files = find_band_files(input_path, required_bands, resolution)
     for band_name in required_bands:
-        band_list = list(input_path.rglob(f"*{band_name}*")) or list(input_path.rglob(f"*{band_name}*.jp2"))
-        
-        if band_list:  # Only store if a file is found
-            band_files[band_name] = band_list[0]  # Take the first match
-        else:
+        if band_name not in band_files:
             print(f"Warning: Band {band_name} not found in {input_path}, skipping.")
     
     # Ensure at least one valid band was found
     if not band_files:
         raise ValueError("No valid bands found. Check your file names and folder.")
+
+    if output_format.upper() == "VRT":
+        return _stack_bands_vrt(band_files, output_path, resolution, resampling)
+    if streaming:
+        return _stack_bands_streaming(band_files, output_path, resolution, memory_budget_mb, max_workers)
     
     data = []  # List to hold band data
     profile = None  # Metadata profile of the raster
     crs_set = set()  # Set to store unique coordinate reference systems (CRS)
     resolutions = set()  # Set to store unique resolutions
-    
-    # Read each band file and process the data
-    for band_name, band_path in band_files.items():
-        with rio.open(band_path) as src:
-            if profile is None:
-                profile = src.profile  # Store the first raster's metadata
-            crs_set.add(src.crs)  # Store CRS
-            resolutions.add((src.res[0], src.res[1]))  # Store resolution
-            dtypes.add(src.dtypes[0])  # Store data type
-            
-            # Determine the native resolution of the raster
-            native_resolution = src.res[0]
-            
-            # If no resolution is specified, use the highest resolution available
-            if resolution is None:
-                resolution = max(res[0] for res in resolutions)
-            
-            # Compute resampling scale factor
-            scale_factor = native_resolution / resolution
-            # Ensure scale_factor never results in zero-sized dimensions
-            new_height = max(1, int(src.height * scale_factor))
-            new_width = max(1, int(src.width * scale_factor))
-            # Handle multi-band files correctly
-            if src.count > 1:
-                # Retrieve band descriptions or generate default names
-                existing_band_descriptions = src.descriptions if any(src.descriptions) else [f"{band_name}_B{i}" for i in range(1, src.count + 1)]
-                
-                for i in range(1, src.count + 1):  # Read all bands
-                    if native_resolution == resolution:
-                        data.append(src.read(i))
-                    else:
-                        # Resample band to target resolution
-                        data.append(
-                            src.read(
-                                i,
-                                out_shape=(new_height, new_width)
-                            )
-                        )
-                    found_bands.append(existing_band_descriptions[i-1])  # Store band names
-            else:
-                if native_resolution == resolution:
-                    data.append(src.read(1))
-                else:
-                    # Resample band to target resolution
-                    data.append(
-                        src.read(
-                            1,
-                            out_shape=(
-                                int(src.height * scale_factor),
-                                int(src.width * scale_factor),
-                            ),
-                        )
-                    )
-                found_bands.append(band_name)  # Store band name
+
+    # If no resolution is specified, the first band fixes it (only its metadata is read here)
+    if resolution is None:
+        with rio.open(next(iter(band_files.values()))) as src:
+            resolution = src.res[0]
+
+    # Decode and resample the band files concurrently; map() returns the results in band order
+    with ThreadPoolExecutor(max_workers=worker_count(max_workers, len(band_files))) as executor:
+        results = list(executor.map(lambda item: _read_band_file(item[0], item[1], resolution), band_files.items()))
+
+    for result in results:
+        if profile is None:
+            profile = result["profile"]  # Store the first raster's metadata
+        crs_set.add(result["crs"])  # Store CRS
+        resolutions.add(result["res"])  # Store resolution
+        dtypes.add(result["dtype"])  # Store data type
+        data.extend(result["data"])
+        found_bands.extend(result["names"])  # Store band names
     
     # Warnings for potential data inconsistencies
-    if len(crs_set) > 1:
-        print("Warning: Different CRS detected. Ensure compatibility before analysis.")
-    if len(resolutions) > 1:
-        print("Warning: Different resolutions detected. Consider resampling before stacking.")
-    if len(dtypes) > 1:
-        print("Warning: Different data types detected among bands. The output type may be automatically adjusted.")
+    _warn_inconsistencies(crs_set, resolutions, dtypes)
     
     # Convert data to a NumPy array for easier manipulation
     data = np.array(data)
@@ -125,8 +111,8 @@ def stack_bands(input_path: Union[Path, str], required_bands: List[str], output_
         dtype=data.dtype,  # Data type
         height=data.shape[1],  # Image height
         width=data.shape[2],  # Image width
-        driver="GTiff",  # Output format (GeoTIFF)
     )
+    profile = output_profile(profile)  # Tiled, compressed GeoTIFF with internal overviews
 
     # Write the stacked raster to the output file
     with rio.open(output_path, "w", **profile) as dst:
@@ -135,7 +121,250 @@ def stack_bands(input_path: Union[Path, str], required_bands: List[str], output_
         
         # Set band descriptions for better readability
         dst.descriptions = tuple(found_bands)
+        build_overviews(dst)
     
     print(f"Stacked raster saved at {output_path}")
 
-    return str(output_path)  # Return the path of the saved file
\ No newline at end of file
+    return str(output_path)  # Return the path of the saved file
+
+def default_stack_path(input_path, output_format="GTiff"):
+    """
+    Returns the default output path of a stack: "stacked.tif" (or "stacked.vrt") inside the product folder,
+    or "<name>_stacked.tif" next to a product archive.
+    """
+    input_path = Path(input_path)
+    extension = ".vrt" if output_format.upper() == "VRT" else ".tif"
+    if is_archive(input_path):
+        name = input_path.name
+        for archive_extension in ARCHIVE_PREFIXES:
+            if name.lower().endswith(archive_extension):
+                name = name[:-len(archive_extension)]
+                break
+        return input_path.with_name(f"{name}_stacked{extension}")
+    return input_path / f"stacked{extension}"
+
+
+def _warn_inconsistencies(crs_set, resolutions, dtypes):
+    """Prints warnings when the stacked bands do not share CRS, resolution or data type."""
+    if len(crs_set) > 1:
+        print("Warning: Different CRS detected. Ensure compatibility before analysis.")
+    if len(resolutions) > 1:
+        print("Warning: Different resolutions detected. Consider resampling before stacking.")
+    if len(dtypes) > 1:
+        print("Warning: Different data types detected among bands. The output type may be automatically adjusted.")
+
+
+def _read_band_file(band_name, band_path, resolution):
+    """
+    Reads (and resamples to `resolution`) every band of one band file.
+
+    Runs in a worker thread: each call opens its own dataset handle, and GDAL releases the GIL while decoding.
+
+    Returns:
+        dict: The band arrays and names plus the file metadata needed to build the output profile.
+    """
+    data = []
+    names = []
+    with rio.open(band_path) as src:
+        # Determine the native resolution of the raster
+        native_resolution = src.res[0]
+
+        # Compute resampling scale factor
+        scale_factor = native_resolution / resolution
+        # Ensure scale_factor never results in zero-sized dimensions
+        new_height = max(1, int(src.height * scale_factor))
+        new_width = max(1, int(src.width * scale_factor))
+        # Handle multi-band files correctly
+        if src.count > 1:
+            # Retrieve band descriptions or generate default names
+            existing_band_descriptions = src.descriptions if any(src.descriptions) else [f"{band_name}_B{i}" for i in range(1, src.count + 1)]
+
+            for i in range(1, src.count + 1):  # Read all bands
+                if native_resolution == resolution:
+                    data.append(src.read(i))
+                else:
+                    # Resample band to target resolution
+                    data.append(src.read(i, out_shape=(new_height, new_width)))
+                names.append(existing_band_descriptions[i-1])  # Store band names
+        else:
+            if native_resolution == resolution:
+                data.append(src.read(1))
+            else:
+                # Resample band to target resolution
+                data.append(
+                    src.read(
+                        1,
+                        out_shape=(
+                            int(src.height * scale_factor),
+                            int(src.width * scale_factor),
+                        ),
+                    )
+                )
+            names.append(band_name)  # Store band name
+
+        return {
+            "data": data,
+            "names": names,
+            "profile": src.profile,
+            "crs": src.crs,
+            "res": (src.res[0], src.res[1]),
+            "dtype": src.dtypes[0],
+        }
+
+
+def _describe_sources(band_files, resolution):
+    """
+    Reads the metadata of every band file and computes the output grid of the stack.
+
+    Returns:
+        tuple: (sources, found_bands, profile, resolution, dtype), where `sources` has one entry per band file
+        (in stacking order) and `profile` is already updated for the stacked output.
+    """
+    sources = []  # One entry per band file, in stacking order
+    found_bands = []
+    profile = None
+    crs_set = set()
+    resolutions = set()
+    dtypes = set()
+
+    for band_name, band_path in band_files.items():
+        with rio.open(band_path) as src:
+            if profile is None:
+                profile = src.profile
+            crs_set.add(src.crs)
+            resolutions.add((src.res[0], src.res[1]))
+            dtypes.add(src.dtypes[0])
+
+            # Same rule as the in-memory mode: the first band fixes the target resolution
+            if resolution is None:
+                resolution = src.res[0]
+
+            scale_factor = src.res[0] / resolution
+            if src.count > 1:
+                descriptions = src.descriptions if any(src.descriptions) else [f"{band_name}_B{i}" for i in range(1, src.count + 1)]
+                found_bands.extend(descriptions)
+            else:
+                found_bands.append(band_name)
+
+            sources.append({
+                "path": band_path,
+                "count": src.count,
+                "dtype": src.dtypes[0],
+                "scale_factor": scale_factor,
+                "height": src.height,
+                "width": src.width,
+                "shape": (max(1, int(src.height * scale_factor)), max(1, int(src.width * scale_factor))),
+            })
+
+    _warn_inconsistencies(crs_set, resolutions, dtypes)
+
+    height, width = sources[0]["shape"]
+    for source in sources:
+        if source["shape"] != (height, width):
+            raise ValueError(f"Band file {source['path']} resamples to {source['shape']}, expected {(height, width)}. Cannot stack bands with different extents.")
+
+    dtype = np.result_type(*dtypes)  # Same promotion np.array() applies in the in-memory mode
+
+    profile["transform"] = rio.transform.from_origin(
+        profile["transform"][2],
+        profile["transform"][5],
+        resolution,
+        resolution,
+    )
+    profile.update(
+        count=len(found_bands),
+        dtype=dtype,
+        height=height,
+        width=width,
+    )
+
+    return sources, found_bands, profile, resolution, dtype
+
+
+def _stack_bands_streaming(band_files, output_path, resolution, memory_budget_mb, max_workers):
+    """
+    Writes the stack band by band, one tile-aligned window at a time.
+
+    Only the metadata of every band file is read up front; pixel data is read, resampled and written
+    window by window, so each worker thread holds at most one window of one band in memory.
+    """
+    sources, found_bands, profile, resolution, dtype = _describe_sources(band_files, resolution)
+    height, width = profile["height"], profile["width"]
+
+    profile = output_profile(profile)  # Tiled output, so that windows map onto whole internal blocks
+
+    # The budget is shared by the workers, each holding one window of one band (at most as many workers as
+    # can each hold a tile row)
+    workers = worker_count(max_workers, len(sources), width * np.dtype(dtype).itemsize * min(DEFAULT_BLOCK_SIZE, height), memory_budget_mb)
+    windows = list(block_windows(height, width, np.dtype(dtype).itemsize, memory_budget_mb / workers))
+
+    # First output band of every source file
+    first_bands = np.cumsum([1] + [source["count"] for source in sources[:-1]])
+
+    with rio.open(output_path, "w", **profile) as dst:
+        write_lock = threading.Lock()  # A dataset handle must not be written from several threads at once
+
+        def stream_source(source, dst_band):
+            with rio.open(source["path"]) as src:
+                for i in range(1, source["count"] + 1):
+                    for window in windows:
+                        if source["scale_factor"] == 1:
+                            data = src.read(i, window=window)
+                        else:
+                            # Read the matching source area and resample it to the output window
+                            src_window = scale_window(window, source["scale_factor"], source["height"], source["width"])
+                            data = src.read(i, window=src_window, out_shape=(int(window.height), int(window.width)))
+                        with write_lock:
+                            dst.write(data.astype(dtype, copy=False), int(dst_band), window=window)
+                    dst_band += 1
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Each source writes to its own output bands, so the band order does not depend on scheduling
+            for future in [executor.submit(stream_source, source, dst_band) for source, dst_band in zip(sources, first_bands)]:
+                future.result()  # Re-raise worker errors
+
+        dst.descriptions = tuple(found_bands)
+        build_overviews(dst)
+
+    print(f"Stacked raster saved at {output_path}")
+
+    return str(output_path)
+
+
+def _stack_bands_vrt(band_files, output_path, resolution, resampling):
+    """
+    Writes the stack as a GDAL VRT that references the original band files.
+
+    No pixel data is copied: each VRT band points at a band of a source file, with the output grid,
+    band description and resampling method declared in the XML. Readers decode the source files lazily.
+    """
+    sources, found_bands, profile, resolution, dtype = _describe_sources(band_files, resolution)
+    gdal_type = _GDAL_DATA_TYPES[np.dtype(dtype).name]
+
+    vrt = ET.Element("VRTDataset", rasterXSize=str(profile["width"]), rasterYSize=str(profile["height"]))
+    if profile.get("crs"):
+        ET.SubElement(vrt, "SRS").text = profile["crs"].to_wkt()
+    ET.SubElement(vrt, "GeoTransform").text = ", ".join(repr(float(v)) for v in profile["transform"].to_gdal())
+
+    dst_band = 1
+    for source in sources:
+        for i in range(1, source["count"] + 1):
+            band = ET.SubElement(vrt, "VRTRasterBand", dataType=gdal_type, band=str(dst_band))
+            ET.SubElement(band, "Description").text = found_bands[dst_band - 1]
+            if profile.get("nodata") is not None:
+                ET.SubElement(band, "NoDataValue").text = repr(float(profile["nodata"]))
+
+            band_source = ET.SubElement(band, "ComplexSource", resampling=resampling)
+            ET.SubElement(band_source, "SourceFilename", relativeToVRT="0").text = str(source["path"])  # Absolute (or /vsizip/) path
+            ET.SubElement(band_source, "SourceBand").text = str(i)
+            ET.SubElement(band_source, "SourceProperties", RasterXSize=str(source["width"]), RasterYSize=str(source["height"]),
+                          DataType=_GDAL_DATA_TYPES[np.dtype(source["dtype"]).name])
+            ET.SubElement(band_source, "SrcRect", xOff="0", yOff="0", xSize=str(source["width"]), ySize=str(source["height"]))
+            ET.SubElement(band_source, "DstRect", xOff="0", yOff="0", xSize=str(profile["width"]), ySize=str(profile["height"]))
+            dst_band += 1
+
+    ET.ElementTree(vrt).write(output_path, encoding="utf-8")
+
+    print(f"Virtual stacked raster saved at {output_path}")
+
+    return str(output_path)
@@ -0,0 +1,52 @@
+from scripts.blocks import block_windows, parallel_tiles, rows_per_block, strip_windows, tile_size
+
+MB = 1024 * 1024
+
+
+def test_rows_per_block_stays_within_budget():
+    # A Sentinel-2 tile with ~15 bands read plus scratch planes: one 512-row strip would be ~530 MB
+    width, bytes_per_pixel = 10980, 99
+    for memory_budget_mb in (16, 64, 256, 1024):
+        rows = rows_per_block(width, bytes_per_pixel, memory_budget_mb)
+        assert rows * width * bytes_per_pixel <= memory_budget_mb * MB
+        for window in strip_windows(10980, width, rows):
+            assert window.height * window.width * bytes_per_pixel <= memory_budget_mb * MB
+
+
+def test_rows_per_block_keeps_whole_tiles_when_they_fit():
+    assert rows_per_block(1000, 4, 16) % 512 == 0
+    assert rows_per_block(1000, 4, 16) * 1000 * 4 <= 16 * MB
+
+
+def test_workers_share_the_budget():
+    bytes_per_pixel = 99
+    for memory_budget_mb in (16, 256, 4096):
+        for cores in (1, 4, 16):
+            workers, windows = parallel_tiles(10980, 10980, bytes_per_pixel, cores, memory_budget_mb)
+            size = max(max(window.width, window.height) for window in windows)
+            assert workers <= cores
+            assert workers * size * size * bytes_per_pixel <= memory_budget_mb * MB
+    # Parallelism grows with the cores at the default budget, with whole 512x512 tiles
+    assert [parallel_tiles(10980, 10980, bytes_per_pixel, cores, 256)[0] for cores in (1, 4, 16)] == [1, 4, 10]
+    assert all(window.width == 512 for window in parallel_tiles(10980, 10980, bytes_per_pixel, 16, 256)[1][:10])
+
+
+def test_tile_size_stays_within_budget():
+    for memory_budget_mb in (1, 8, 256):
+        side = tile_size(171, memory_budget_mb)
+        assert side * side * 171 <= memory_budget_mb * MB
+    assert tile_size(171, 256) % 512 == 0
+
+
+def test_block_windows_stay_inside_output_tiles_below_one_tile_row():
+    width, bytes_per_pixel = 10980, 99
+    windows = list(block_windows(10980, width, bytes_per_pixel, 16))
+    assert sum(window.width * window.height for window in windows) == 10980 * width
+    blocks = []
+    for window in windows:
+        assert window.width * window.height * bytes_per_pixel <= 16 * MB
+        block = (window.row_off // 512, window.col_off // 512)
+        assert ((window.row_off + window.height - 1) // 512, (window.col_off + window.width - 1) // 512) == block
+        if not blocks or blocks[-1] != block:
+            blocks.append(block)
+    assert len(blocks) == len(set(blocks))  # Each output tile is written in one go
@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+from scripts.model_format import load_compact, read_model_header, save_compact
+from scripts.processing import make_classifier
+
+
+def test_compact_models_predict_like_the_original_and_are_inference_only(tmp_path):
+    rng = np.random.default_rng(0)
+    X = rng.random((200, 4)).astype(np.float32)
+    y = (X[:, 0] + X[:, 1] > 1).astype(np.float64)
+    model = make_classifier("svc", kernel="rbf").fit(X, y)
+    model.bands_ = ["B03", "B08", "B11", "B12"]
+    path = str(tmp_path / "model.npz")
+
+    save_compact(model, path, satellite="S2")
+    assert read_model_header(path)["bands"] == model.bands_
+    loaded = load_compact(path)
+
+    assert np.array_equal(loaded.predict(X), model.predict(X))
+    with pytest.raises(TypeError, match="inference-only"):
+        loaded.named_steps["svm"].fit(X, y)
@@ -0,0 +1,32 @@
+import numpy as np
+import rasterio as rio
+from rasterio.transform import from_origin
+from scripts.preprocessing import _nodata_sample_windows, mask_clouds_any
+
+
+def test_nodata_samples_are_single_blocks():
+    # Striped file: every block is a full-width strip of 8 rows
+    windows = list(_nodata_sample_windows(1000, 700, 16, block_shape=(8, 700)))
+    assert all(w.row_off % 8 == 0 and w.height <= 8 and w.width == 700 for w in windows)
+    assert windows[0].row_off == 0 and windows[1].row_off == 992  # Top and bottom strips first
+
+    # Tiled file: corners and edge midpoints, then interior tiles, never a full row or column
+    windows = list(_nodata_sample_windows(2000, 3000, 16, block_shape=(512, 512)))
+    assert all(w.row_off % 512 == 0 and w.col_off % 512 == 0 and w.height <= 512 and w.width <= 512 for w in windows)
+    assert len(windows) == len({(w.row_off, w.col_off) for w in windows})
+
+
+def test_cloud_mask_output_defaults_next_to_the_source(tmp_path):
+    source = tmp_path / "stacked.tif"
+    scl = np.full((32, 32), 4, dtype=np.uint16)
+    scl[:8] = 9  # Cloud high probability
+    with rio.open(source, "w", driver="GTiff", width=32, height=32, count=3, dtype="uint16", crs="EPSG:32634",
+                  transform=from_origin(500000, 4500000, 10, 10)) as dst:
+        dst.write(np.stack([np.full((32, 32), 1000, dtype=np.uint16)] * 2 + [scl]))
+        dst.descriptions = ("B03", "B08", "SCL")
+
+    output_path = mask_clouds_any(str(source), None, "S2", "auto", False)
+
+    assert output_path == str(tmp_path / "stacked_masked.tif")
+    with rio.open(output_path) as src:
+        assert np.isnan(src.read(1)[:8]).all() and not np.isnan(src.read(1)[8:]).any()
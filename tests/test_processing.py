@@ -0,0 +1,116 @@
+import os
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.transform import from_origin
+from concurrent.futures import Future
+from scripts import processing
+
+BANDS = ["B02", "B03", "B04", "B08", "B8A", "B11", "B12"]
+
+
+def write_scene(path, burned, bands=BANDS, seed=0, size=64):
+    """Writes a small uint16 S2-like stack; the left half is burned (low NIR, high SWIR) if `burned`."""
+    # Each band's noise only depends on its name, so reordered stacks hold the same values
+    data = {band: np.random.default_rng([seed, sum(map(ord, band))]).integers(800, 1200, (size, size)).astype(np.uint16)
+            for band in bands}
+    for band in bands:
+        if band in ("B08", "B8A"):
+            data[band] += 2000
+        if burned and band in ("B08", "B8A"):
+            data[band][:, :size // 2] -= 2000
+        if burned and band in ("B11", "B12"):
+            data[band][:, :size // 2] += 1500
+    with rio.open(path, "w", driver="GTiff", width=size, height=size, count=len(bands), dtype="uint16", nodata=0,
+                  crs="EPSG:32634", transform=from_origin(500000, 4500000, 10, 10)) as dst:
+        dst.write(np.stack([data[band] for band in bands]))
+        dst.descriptions = tuple(bands)
+    return str(path)
+
+
+def test_training_set_follows_the_model_band_order(tmp_path):
+    post = write_scene(tmp_path / "post.tif", burned=True)
+    shuffled = write_scene(tmp_path / "shuffled.tif", burned=True, bands=["B01"] + BANDS[::-1])  # Extra band, reversed order
+    dNBR = np.where(np.arange(64) < 32, 600.0, 0.0)[None, :].repeat(64, axis=0)
+
+    X, y = processing.create_training_set(post, dNBR, samples=200)
+    X_shuffled, y_shuffled = processing.create_training_set(shuffled, dNBR, samples=200, bands=BANDS)
+
+    assert np.array_equal(X_shuffled, X)
+    assert np.array_equal(y_shuffled, y)
+
+
+def test_incremental_training_resumes_from_a_checkpoint(tmp_path):
+    pairs = [(write_scene(tmp_path / f"pre{i}.tif", burned=False, seed=i), write_scene(tmp_path / f"post{i}.tif", burned=True, seed=i))
+             for i in range(2)]
+    checkpoint = str(tmp_path / "checkpoint.pkl")
+
+    processing.train_incremental(pairs[:1], "S2", samples_per_scene=500, checkpoint_path=checkpoint)
+    resumed = processing.load_model(checkpoint)
+    updates = resumed.named_steps["svm"].t_
+
+    model, _, _, accuracy = processing.train_incremental(pairs[1:], "S2", samples_per_scene=500, model=resumed)
+    assert model.named_steps["svm"].t_ > updates
+    assert model.bands_ == BANDS
+    assert accuracy > 0.9
+
+
+def test_incremental_training_rejects_compact_models(tmp_path):
+    pairs = [(write_scene(tmp_path / "pre.tif", burned=False), write_scene(tmp_path / "post.tif", burned=True))]
+    model = processing.train_incremental(pairs, "S2", samples_per_scene=500)[0]
+    processing.save_model(model, str(tmp_path / "model.npz"))
+
+    with pytest.raises(ValueError, match="inference-only"):
+        processing.train_incremental(pairs, "S2", model=processing.load_model(str(tmp_path / "model.npz")))
+    with pytest.raises(ValueError, match=r"\.npz"):
+        processing.train_incremental(pairs, "S2", checkpoint_path=str(tmp_path / "checkpoint.npz"))
+
+
+class InlineExecutor:
+    """Runs submitted tiles in the calling process, recording the worker count classify asked for."""
+    max_workers = None
+
+    def __init__(self, max_workers, initializer, initargs):
+        InlineExecutor.max_workers = max_workers
+        initializer(*initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        processing._close_tile_worker()
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+def test_classify_uses_every_core_within_the_budget(tmp_path, monkeypatch):
+    pairs = [(write_scene(tmp_path / "pre.tif", burned=False), write_scene(tmp_path / "post.tif", burned=True))]
+    model = processing.train_incremental(pairs, "S2", samples_per_scene=500)[0]
+    scene = write_scene(tmp_path / "scene.tif", burned=True, size=1024)
+    monkeypatch.setattr(os, "cpu_count", lambda: 16)
+    monkeypatch.setattr(processing, "ProcessPoolExecutor", InlineExecutor)
+
+    output_path = processing.classify(model, scene, memory_budget_mb=256)
+
+    assert InlineExecutor.max_workers == 16  # One per core, not the 4 that hold two whole 512x512 tiles each
+    with rio.open(output_path) as src:
+        labels = src.read(1)
+    assert (labels[:, :512] == 1).mean() > 0.9 and (labels[:, 512:] == 0).mean() > 0.9
+
+
+def test_check_model_loads_pickled_models_once(tmp_path, monkeypatch):
+    pairs = [(write_scene(tmp_path / "pre.tif", burned=False), write_scene(tmp_path / "post.tif", burned=True))]
+    model = processing.train_incremental(pairs, "S2", samples_per_scene=500)[0]
+    processing.save_model(model, str(tmp_path / "model.pkl"))
+    processing.save_model(model, str(tmp_path / "model.npz"))
+    loads = []
+    monkeypatch.setattr(processing.joblib, "load", lambda path: loads.append(path) or model)
+
+    checked = processing.check_model(str(tmp_path / "model.pkl"), pairs[0][1], "S2")
+
+    assert checked is model and len(loads) == 1
+    assert processing.check_model(checked, pairs[0][1], "S2") is model and len(loads) == 1
+    assert processing.check_model(str(tmp_path / "model.npz"), pairs[0][1], "S2") is None
@@ -0,0 +1,27 @@
+from scripts import stack_cache
+
+KEY = "a" * 64
+
+
+def test_derived_outputs_go_next_to_the_source_product(tmp_path):
+    cache_dir, product = tmp_path / "cache", tmp_path / "S2.SAFE"
+    entry = stack_cache.entry_path(KEY, cache_dir=cache_dir)
+    entry.write_bytes(b"stack")
+    stack_cache.record_origin(KEY, product / "stacked.tif", cache_dir=cache_dir)
+
+    assert stack_cache.derived_path(entry, "_masked") == str(product / "stacked_masked.tif")
+    assert stack_cache.derived_path(tmp_path / "image.tif", "_classified") == str(tmp_path / "image_classified.tif")
+
+
+def test_evict_only_removes_cache_entries(tmp_path):
+    entry = stack_cache.entry_path(KEY, cache_dir=tmp_path)
+    entry.write_bytes(b"x" * 1024)
+    stack_cache.record_origin(KEY, tmp_path / "product" / "stacked.tif", cache_dir=tmp_path)
+    deliverable = tmp_path / f"{KEY}_classified.tif"
+    deliverable.write_bytes(b"x" * 1024)
+
+    stack_cache.evict(max_size_mb=0, cache_dir=tmp_path)
+
+    assert not entry.exists()
+    assert not (tmp_path / f"{KEY}.json").exists()
+    assert deliverable.exists()